@@ -16,13 +16,15 @@
 
 import io
 import asyncio
-import json
+import gzip
+import hashlib
 import os
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 
 import pandas as pd
 from tornado import web
+from tornado.escape import json_encode
 from tornado.options import define, options
 
 import aiohttp
@@ -37,13 +39,48 @@ define("root", default=CURRENT_DIR, help="root dir for templates")
 define("cache_interval", default=20, help="cache interval in seconds")
 
 
-# Global cached data.
-CACHED_DATA = []
+class EncodedResponse:
+    """The /data.json response for one version of the data, encoded once.
+
+    Holds the JSON body and its gzipped copy, each with its own strong ETag,
+    so serving a request only picks one of them and writes it. data_json, the
+    JSON array of records, is spliced into the body as is. The ETags are
+    derived from it alone and last_updated is when it was first fetched, so
+    a refresh that fetches the same data keeps this response (see
+    format_data) and clients keep their cached copy.
+    """
+
+    def __init__(self, data_json, last_updated):
+        self.digest = hashlib.sha256(data_json.encode("utf-8")).hexdigest()
+        last_updated_json = json_encode(
+            datetime.fromtimestamp(last_updated).strftime("%d %b %Y %H:%M:%S")
+        )
+        body = f'{{"data": {data_json}, "last_updated": {last_updated_json}}}'
+        self.body = body.encode("utf-8")
+        self.gzip_body = gzip.compress(self.body, mtime=0)
+        self.etag = f'"{self.digest}"'
+        self.gzip_etag = f'"{self.digest}-gzip"'
+        self.last_modified = datetime.fromtimestamp(last_updated, timezone.utc)
+
+
+# Global cached response.
+CACHED_RESPONSE = None
 # Global last update timestamp
 LAST_UPDATED = None
+# Hash of the CSV the cached response was built from.
+CACHED_CSV_HASH = None
 
 
+# Rebuilds the cached response only if the data changed: an unchanged CSV is
+# not parsed again, and a changed CSV that gives the same records keeps the
+# previous response.
 def format_data(data):
+    global LAST_UPDATED
+    LAST_UPDATED = int(time.time())
+    global CACHED_CSV_HASH
+    csv_hash = hashlib.sha256(data.encode("utf-8")).hexdigest()
+    if csv_hash == CACHED_CSV_HASH:
+        return
     df = pd.read_csv(io.StringIO(data))
     codes = pd.read_csv(os.path.join(CURRENT_DIR, "country-codes.csv"))
     codes = (
@@ -56,10 +93,15 @@ def format_data(data):
         .astype({"numeric_code": "int"})
     )
     merged = df.merge(codes, on="region_code")
-    global CACHED_DATA
-    CACHED_DATA = merged.to_json(orient="records")
-    global LAST_UPDATED
-    LAST_UPDATED = int(time.time())
+    data_json = merged.to_json(orient="records")
+    global CACHED_RESPONSE
+    if (
+        CACHED_RESPONSE is None
+        or hashlib.sha256(data_json.encode("utf-8")).hexdigest()
+        != CACHED_RESPONSE.digest
+    ):
+        CACHED_RESPONSE = EncodedResponse(data_json, LAST_UPDATED)
+    CACHED_CSV_HASH = csv_hash
 
 
 async def fetch_remote_data():
@@ -74,23 +116,53 @@ async def fetch_data():
     now = int(time.time())
     if not LAST_UPDATED or (LAST_UPDATED + options.cache_interval) < now:
         await fetch_remote_data()
-    return json.loads(CACHED_DATA)
+    return CACHED_RESPONSE
+
+
+# True if an Accept-Encoding header accepts gzip: it lists gzip, or failing
+# that *, with a nonzero quality. "gzip;q=0" refuses gzip.
+def accepts_gzip(accept_encoding):
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
 
 
 class DataHandler(web.RequestHandler):
-    """Serves requests for data."""
+    """Serves requests for data.
+
+    The response is encoded once per version of the data (see
+    EncodedResponse). Clients that accept gzip (see accepts_gzip) get the
+    gzipped copy, and a request whose If-None-Match matches the ETag of what
+    it would get is answered with 304 and no body.
+    """
 
     async def get(self):
-        self.set_header("Content-Type", "application/json")
-        self.write(
-            {
-                "data": await fetch_data(),
-                "last_updated": datetime.fromtimestamp(LAST_UPDATED).strftime(
-                    "%d %b %Y %H:%M:%S"
-                ),
-            }
-        )
-        self.finish()
+        response = await fetch_data()
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.set_header("Last-Modified", response.last_modified)
+        self.set_header("Vary", "Accept-Encoding")
+        if accepts_gzip(self.request.headers.get("Accept-Encoding", "")):
+            self.set_header("Content-Encoding", "gzip")
+            self.set_header("Etag", response.gzip_etag)
+            body = response.gzip_body
+        else:
+            self.set_header("Etag", response.etag)
+            body = response.body
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+        else:
+            self.finish(body)
 
 
 async def world_map():
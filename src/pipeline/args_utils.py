@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import argparse
+import logging
 import os
 
 import path_utils
@@ -24,6 +25,24 @@ class _AbsPathAction(argparse.Action):
         setattr(namespace, self.dest, os.path.abspath(values))
 
 
+# Integer argument that must be at least 1, for counts of workers and downloads.
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {number}')
+    return number
+
+
+# --jobs must be at least 1 and is capped at the number of CPUs.
+def _jobs(value):
+    jobs = _positive_int(value)
+    max_jobs = os.cpu_count() or 1
+    if jobs > max_jobs:
+        logging.warning('--jobs %d is more than the %d available CPUs, using %d.', jobs, max_jobs, max_jobs)
+        jobs = max_jobs
+    return jobs
+
+
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--allowlist', '-w', dest='allowlist', action='store_true',
@@ -36,6 +55,15 @@ def get_parser():
     parser.add_argument(
         '--publish_dir', default=path_utils.root_dir, action=_AbsPathAction,
         help='Base directory where outputs are written. Default value writes to the current directory tree.')
+    parser.add_argument('--jobs', '-j', type=_jobs, default=1,
+                        help='Number of workers used to load sources, annotate Google exports and write the '
+                             'scraped csv files, at most the number of CPUs. Default value runs sequentially.')
+    parser.add_argument('--max_downloads', type=_positive_int, default=8,
+                        help='Maximum number of downloads in flight in fetch_automatic_downloads.py, at least 1.')
+    parser.add_argument('--show_cache', action='store_true',
+                        help='Print the contents of the parse cache of loaded sources and exit.')
+    parser.add_argument('--clear_cache', action='store_true',
+                        help='Delete the parse cache of loaded sources and exit.')
     parser.set_defaults(allowlist=True)
 
     return parser
@@ -0,0 +1,352 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import shutil
+import pandas as pd
+
+import path_utils
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose code determines what a load function returns, including this
+# one, which reads Excel snapshots through their sidecars and caches the
+# frames. Changing any of them (or data.yaml, or locations.csv) invalidates
+# every cached frame.
+LOAD_CODE_FILES = ['cache_utils.py', 'config.py', 'date_utils.py', 'load_functions.py', 'load_utils.py',
+                   'region_utils.py']
+# Modules that turn loaded frames into an aggregated export; part of every
+# export manifest signature on top of LOAD_CODE_FILES.
+EXPORT_CODE_FILES = ['export_utils.py', 'join_data.py', 'load_data.py']
+# Modules that annotate the Google exports with region codes.
+ANNOTATION_CODE_FILES = ['export_utils.py', 'region_utils.py']
+# Sidecar in each Google export directory recording what every file in it was
+# annotated from.
+ANNOTATION_MANIFEST = '.annotation_manifest.json'
+# Libraries whose version can change what a snapshot parses to, or whether it
+# parses at all (e.g. a missing Excel engine).
+LOAD_LIBRARIES = ['numpy', 'openpyxl', 'pandas', 'pyarrow', 'xlrd']
+# Load errors that can come from the environment rather than the snapshot.
+# They are not recorded, so the snapshot is tried again on the next run.
+ENVIRONMENT_ERRORS = (ImportError, MemoryError, OSError)
+DATA_YAML = os.path.abspath(os.path.join(PIPELINE_DIR, '../config/data.yaml'))
+
+_file_hashes = {}
+_load_version = None
+_library_versions = None
+_load_statuses = {}
+
+
+# Content hash of a file, memoized per process on (path, size, mtime). Blobs
+# in the snapshot blob store are named by their hash, so they are not read.
+def file_hash(path):
+    if path_utils.is_blob_path(path):
+        return os.path.basename(path).split('.')[0]
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime)
+    if memo_key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _file_hashes[memo_key] = sha.hexdigest()
+    return _file_hashes[memo_key]
+
+def params_hash(params):
+    hashed_params = {k: v for k, v in params.items() if k not in ['export_path', 'export_jobs']}
+    return hashlib.sha256(json.dumps(hashed_params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+# {library: installed version, or None if it is not installed} for LOAD_LIBRARIES.
+def library_versions():
+    global _library_versions  # pylint: disable=global-statement
+    if _library_versions is None:
+        _library_versions = {}
+        for library in LOAD_LIBRARIES:
+            try:
+                _library_versions[library] = importlib.metadata.version(library)
+            except importlib.metadata.PackageNotFoundError:
+                _library_versions[library] = None
+    return _library_versions
+
+# Hash of the load, date and region code plus the files they read and the
+# versions of the libraries they parse with.
+def load_version():
+    global _load_version  # pylint: disable=global-statement
+    if _load_version is None:
+        sha = hashlib.sha256()
+        sha.update(json.dumps(library_versions(), sort_keys=True).encode('utf-8'))
+        for code_file in LOAD_CODE_FILES:
+            sha.update(file_hash(os.path.join(PIPELINE_DIR, code_file)).encode('utf-8'))
+        sha.update(file_hash(DATA_YAML).encode('utf-8'))
+        sha.update(file_hash(path_utils.path_to('locations_csv')).encode('utf-8'))
+        _load_version = sha.hexdigest()
+    return _load_version
+
+def cache_key(data_path, params):
+    sha = hashlib.sha256()
+    sha.update(file_hash(data_path).encode('utf-8'))
+    sha.update(params_hash(params).encode('utf-8'))
+    sha.update(load_version().encode('utf-8'))
+    return sha.hexdigest()
+
+def cache_path(data_path, params):
+    return os.path.join(path_utils.path_to('parse_cache_dir'), params['config_key'],
+                        cache_key(data_path, params) + '.parquet')
+
+# Returns load_func(data_path, params), reading it from the parse cache when the
+# snapshot, source config and load code are unchanged since it was written.
+# Only single-file snapshots whose load function returns a frame are cached.
+def cached_load(load_func, data_path, params):
+    if not os.path.isfile(data_path):
+        return load_func(data_path, params)
+    df_path = cache_path(data_path, params)
+    if os.path.exists(df_path):
+        try:
+            return pd.read_parquet(df_path)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning('Could not read parse cache %s, reloading: %s', df_path, str(e))
+    df = load_func(data_path, params)
+    if df is not None:
+        write_cached(df, df_path)
+    return df
+
+# Returns True if df was written to df_path.
+def write_cached(df, df_path):
+    os.makedirs(os.path.dirname(df_path), exist_ok=True)
+    tmp_path = f'{df_path}.{os.getpid()}.tmp'
+    try:
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, df_path)
+        return True
+    except Exception as e:  # pylint: disable=broad-except
+        logging.info('Not caching %s: %s', df_path, str(e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+# Version of the Excel sidecar format. Changing it (or the version of a library
+# in LOAD_LIBRARIES) invalidates every sidecar.
+EXCEL_SIDECAR_VERSION = 1
+
+# Path of the sidecar for read_args of the snapshot at path, without its
+# extension (.parquet, or .pkl for sheets Parquet can't store exactly).
+def excel_sidecar_path(path, read_args):
+    args_key = json.dumps([EXCEL_SIDECAR_VERSION, library_versions(), read_args], sort_keys=True, default=str)
+    return os.path.join(path_utils.path_to('excel_cache_dir'), file_hash(path),
+                        hashlib.sha256(args_key.encode('utf-8')).hexdigest())
+
+def read_excel_sidecar(sidecar_path):
+    for extension, read_func in [('.parquet', pd.read_parquet), ('.pkl', pd.read_pickle)]:
+        if os.path.exists(sidecar_path + extension):
+            try:
+                return read_func(sidecar_path + extension)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning('Could not read Excel sidecar %s: %s', sidecar_path + extension, str(e))
+    return None
+
+# Writes df as Parquet if it reads back unchanged, otherwise (e.g. for object
+# columns mixing numbers and strings, which Parquet converts or rejects) as a
+# pickle.
+def write_excel_sidecar(df, sidecar_path):
+    if write_cached(df, sidecar_path + '.parquet'):
+        if pd.read_parquet(sidecar_path + '.parquet').equals(df):
+            return
+        os.remove(sidecar_path + '.parquet')
+    tmp_path = f'{sidecar_path}.{os.getpid()}.tmp'
+    try:
+        df.to_pickle(tmp_path, compression=None)
+        os.replace(tmp_path, sidecar_path + '.pkl')
+    except Exception as e:  # pylint: disable=broad-except
+        logging.info('Not caching %s: %s', sidecar_path, str(e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Returns pd.read_excel(path, **read_args), restricted to the sheet's columns in
+# columns if given. The first read of each sheet of a snapshot writes the whole
+# sheet to a sidecar keyed by the snapshot's content and read_args, and later
+# reads use the sidecar. Snapshots never change, so the sidecar outlives
+# changes to the load code that invalidate the parse cache.
+def read_excel_cached(path, columns=None, **read_args):
+    sidecar_path = excel_sidecar_path(path, read_args)
+    df = read_excel_sidecar(sidecar_path)
+    if df is None:
+        df = pd.read_excel(path, **read_args)
+        write_excel_sidecar(df, sidecar_path)
+    if columns is not None:
+        df = df.drop(columns=[c for c in df.columns if c not in columns])
+    return df
+
+def load_status_path(params):
+    return os.path.join(path_utils.path_to('load_status_dir'), params['config_key'] + '.json')
+
+# Load status manifest for a source: {cache_key: {'path', 'status', 'error'}}.
+# Entries are keyed like the parse cache, so they go stale when the snapshot,
+# the source config or the load code changes.
+def read_load_statuses(params):
+    manifest_path = load_status_path(params)
+    if manifest_path not in _load_statuses:
+        _load_statuses[manifest_path] = path_utils.read_json(manifest_path, {})
+    return _load_statuses[manifest_path]
+
+# Drops this process's copy of a source's load statuses, so the next read sees
+# statuses recorded by other processes (e.g. load_data's worker pool).
+def forget_load_statuses(params):
+    _load_statuses.pop(load_status_path(params), None)
+
+# Returns the recorded error if this exact snapshot is known to fail with the
+# current config and load code, otherwise None.
+def known_load_failure(data_path, params):
+    if not os.path.isfile(data_path):
+        return None
+    status = read_load_statuses(params).get(cache_key(data_path, params))
+    if status is None or status['status'] != 'failed':
+        return None
+    return status['error']
+
+def record_load_status(data_path, params, error=None):
+    if not os.path.isfile(data_path):
+        return
+    statuses = read_load_statuses(params)
+    key = cache_key(data_path, params)
+    for stale_key in [k for k, v in statuses.items() if v['path'] == data_path and k != key]:
+        del statuses[stale_key]
+    statuses[key] = {
+        'path': data_path,
+        'status': 'ok' if error is None else 'failed',
+        'error': error,
+    }
+    path_utils.write_json(load_status_path(params), statuses)
+
+# Identifies what a source would load right now: the cache key of its newest
+# snapshot that is not known to fail, or None if it has no such snapshot.
+def source_signature(params):
+    for data_dict in path_utils.all_data_most_to_least_recent(params):
+        data_path = data_dict['path']
+        if os.path.isfile(data_path) and known_load_failure(data_path, params) is None:
+            return cache_key(data_path, params)
+    return None
+
+# Hash of the population table the join computes per-capita columns from, or
+# None if there is none.
+def population_hash():
+    population_path = path_utils.path_to('population_csv')
+    if not os.path.exists(population_path):
+        return None
+    return file_hash(population_path)
+
+# Hash of the signatures of every source in config_dict providing data_type,
+# plus the code and population table that load, join and export them.
+def data_type_signature(data_type, config_dict):
+    source_signatures = sorted(
+        (k, source_signature(params)) for k, params in config_dict.items()
+        if 'data' in params and data_type in params['data'])
+    export_code_hashes = [file_hash(os.path.join(PIPELINE_DIR, code_file)) for code_file in EXPORT_CODE_FILES]
+    signature = [load_version(), export_code_hashes, population_hash(), source_signatures]
+    return hashlib.sha256(json.dumps(signature).encode('utf-8')).hexdigest()
+
+def export_cache_dir(export_path):
+    export_name = os.path.splitext(os.path.basename(export_path))[0]
+    return os.path.join(path_utils.path_to('export_cache_dir'), export_name)
+
+# Export manifest for an aggregated export:
+# {'output_hash': ..., 'data_types': {data_type: {'signature': ..., 'has_data': ...}}}.
+def export_manifest_path(export_path):
+    return os.path.join(export_cache_dir(export_path), 'manifest.json')
+
+def read_export_manifest(export_path):
+    return path_utils.read_json(export_manifest_path(export_path), {'output_hash': None, 'data_types': {}})
+
+# Hash of the annotation code and locations.csv; a change re-annotates every file.
+def annotation_version():
+    sha = hashlib.sha256()
+    for code_file in ANNOTATION_CODE_FILES:
+        sha.update(file_hash(os.path.join(PIPELINE_DIR, code_file)).encode('utf-8'))
+    sha.update(file_hash(path_utils.path_to('locations_csv')).encode('utf-8'))
+    return sha.hexdigest()
+
+# Annotation manifest for a Google export directory:
+# {'version': ..., 'files': {relative path: annotation_entry(...)}}.
+def annotation_manifest_path(export_dir):
+    return os.path.join(export_dir, ANNOTATION_MANIFEST)
+
+def read_annotation_manifest(export_dir):
+    return path_utils.read_json(annotation_manifest_path(export_dir), {'version': None, 'files': {}})
+
+# Entries record contents only, not mtimes: the manifest is committed with the
+# exports, and a fresh checkout gives every file a new mtime.
+def annotation_entry(input_path, output_path):
+    return {
+        'source_size': os.path.getsize(input_path),
+        'source_hash': file_hash(input_path),
+        'output_size': os.path.getsize(output_path),
+        'output_hash': file_hash(output_path),
+    }
+
+# True if output_path is still the annotation recorded in entry: both the
+# source and the output have the recorded size and contents. Sizes are
+# compared first, so most changed files are found without hashing them.
+def annotation_is_current(entry, input_path, output_path):
+    if entry is None or 'output_hash' not in entry or not os.path.exists(output_path):
+        return False
+    if (os.path.getsize(input_path) != entry['source_size']
+            or os.path.getsize(output_path) != entry['output_size']):
+        return False
+    return file_hash(input_path) == entry['source_hash'] and file_hash(output_path) == entry['output_hash']
+
+# Returns {source: (number of cached files, total bytes)}.
+def cache_summary():
+    summary = {}
+    cache_dir = path_utils.path_to('parse_cache_dir')
+    if not os.path.isdir(cache_dir):
+        return summary
+    for source in sorted(os.listdir(cache_dir)):
+        source_dir = os.path.join(cache_dir, source)
+        if not os.path.isdir(source_dir):
+            continue
+        files = [os.path.join(source_dir, f) for f in os.listdir(source_dir)]
+        summary[source] = (len(files), sum(os.path.getsize(f) for f in files))
+    return summary
+
+def print_cache_summary():
+    summary = cache_summary()
+    print('Parse cache: ', path_utils.path_to('parse_cache_dir'))
+    for source, (num_files, num_bytes) in summary.items():
+        print(f'  {source}: {num_files} files, {num_bytes / 1e6:.1f} MB')
+    if len(summary) == 0:
+        print('  (empty)')
+    excel_cache_dir = path_utils.path_to('excel_cache_dir')
+    if os.path.isdir(excel_cache_dir):
+        sidecars = [os.path.join(path, f) for path, _, files in os.walk(excel_cache_dir) for f in files]
+        print('Excel sidecars: ', excel_cache_dir)
+        print(f'  {len(sidecars)} files, {sum(os.path.getsize(f) for f in sidecars) / 1e6:.1f} MB')
+    status_dir = path_utils.path_to('load_status_dir')
+    if os.path.isdir(status_dir):
+        print('Snapshots known to fail loading: ', status_dir)
+        for manifest_file in sorted(os.listdir(status_dir)):
+            source = os.path.splitext(manifest_file)[0]
+            statuses = read_load_statuses({'config_key': source})
+            num_failed = len([v for v in statuses.values() if v['status'] == 'failed'])
+            if num_failed > 0:
+                print(f'  {source}: {num_failed} snapshots')
+
+def clear_cache():
+    cache_dir = path_utils.path_to('cache_dir')
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    _load_statuses.clear()
+    print('Cleared cache: ', cache_dir)
@@ -15,10 +15,11 @@
 import yaml
 import os
 
+import path_utils
+
 DATA_YAML = os.path.abspath(os.path.join(__file__, '../../config/data.yaml'))
 ALLOWLIST_YAML = os.path.abspath(os.path.join(__file__, '../../config/allowlist.yaml'))
 SOURCES_DIR = os.path.abspath(os.path.join(__file__, '../../config/sources'))
-DATA_INPUTS_DIR = os.path.abspath(os.path.join(__file__, '../../../data/inputs/'))
 
 def read_data_schema():
     with open(DATA_YAML) as file:
@@ -50,10 +51,9 @@ def other_region_columns():
             'level_3_region_code']
 
 def get_sources_with_data():
-    downloaded_dir = os.path.join(DATA_INPUTS_DIR, 'downloaded')
-    scraped_dir = os.path.join(DATA_INPUTS_DIR, 'scraped')
-    downloaded_sources = [f.name for f in os.scandir(downloaded_dir) if f.is_dir()]
-    scraped_sources = [f.name for f in os.scandir(scraped_dir) if f.is_dir()]
+    catalog = path_utils.get_snapshot_catalog()
+    downloaded_sources = catalog.source_names('downloaded')
+    scraped_sources = catalog.source_names('scraped')
     scraped_sources.remove('spreadsheets')
     result = downloaded_sources + scraped_sources
     return result
@@ -14,8 +14,28 @@
 
 # pylint: disable=unused-argument
 
-import pandas as pd
 import datetime
+import os
+import numpy as np
+import pandas as pd
+
+import path_utils
+
+
+# Explicit formats tried, in order, on sources that do not set date_format.
+# Month-first comes before day-first, matching pandas' own inference.
+INFERRED_DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y%m%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%m/%d/%Y',
+    '%d/%m/%Y',
+    '%d.%m.%Y',
+    '%Y/%m/%d',
+]
+
+_date_formats = {}
 
 
 def parse_date(data_df, params):
@@ -23,6 +43,74 @@ def parse_date(data_df, params):
     data_df = globals()[date_parse_func](data_df, params)
     return data_df
 
+# Applies func to each distinct non-null value once and maps the results back.
+def map_unique(values, func):
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([func(u) for u in uniques] + [np.nan], dtype=object)
+    return pd.Series(mapped[codes], index=values.index)
+
+# Parses the distinct values in `values` as dates, trying each format in turn on
+# whatever is still unparsed, and returns datetime64 dates aligned with `values`.
+# Raises ValueError if a non-null value matches none of the formats.
+# With formats=None, falls back to pandas' per-element inference.
+def to_dates(values, formats):
+    codes, uniques = pd.factorize(values)
+    if formats is None or pd.api.types.is_datetime64_any_dtype(uniques):
+        parsed = pd.Series(pd.to_datetime(uniques))
+    else:
+        unique_values = pd.Series(uniques)
+        parsed = pd.Series(pd.NaT, index=unique_values.index, dtype='datetime64[ns]')
+        for date_format in formats:
+            unparsed = parsed.isna()
+            if not unparsed.any():
+                break
+            try:
+                parsed[unparsed] = pd.to_datetime(unique_values[unparsed], format=date_format, errors='coerce')
+            except ValueError:
+                continue
+        if parsed.isna().any():
+            unparsed_value = unique_values[parsed.isna()].iloc[0]
+            raise ValueError(f'time data {unparsed_value!r} does not match any of the formats {formats}')
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_localize(None)
+    dates = np.append(parsed.dt.normalize().to_numpy(), np.datetime64('NaT'))
+    return pd.Series(dates[codes], index=values.index)
+
+# Formats found for each source are kept in one file per source, so worker
+# processes loading different sources never overwrite each other's formats.
+def date_format_path(config_key):
+    return os.path.join(path_utils.path_to('date_formats_dir'), config_key + '.json')
+
+def read_date_format(config_key):
+    if config_key not in _date_formats:
+        _date_formats[config_key] = path_utils.read_json(date_format_path(config_key), None)
+    return _date_formats[config_key]
+
+def write_date_format(config_key, date_format):
+    _date_formats[config_key] = date_format
+    path_utils.write_json(date_format_path(config_key), date_format)
+
+# Returns the first explicit format that parses every distinct value, trying the
+# format found on a previous run first. Found formats are saved in a sidecar so
+# later runs only try that one. Returns None if no single format fits.
+def infer_date_format(values, config_key):
+    uniques = pd.Series(pd.unique(values.dropna()))
+    if pd.api.types.is_datetime64_any_dtype(uniques):
+        return None
+    known_format = read_date_format(config_key)
+    candidates = INFERRED_DATE_FORMATS
+    if known_format is not None:
+        candidates = [known_format] + [f for f in INFERRED_DATE_FORMATS if f != known_format]
+    for date_format in candidates:
+        try:
+            pd.to_datetime(uniques, format=date_format)
+        except ValueError:
+            continue
+        if date_format != known_format:
+            write_date_format(config_key, date_format)
+        return date_format
+    return None
+
 def default(data_df, params):
     date_params = params['load']['dates']
     date_columns = date_params['columns']
@@ -32,21 +120,15 @@ def default(data_df, params):
     })
     if 'date_format' in date_params:
         date_format = date_params['date_format']
-        data_df['date'] = pd.to_datetime(data_df['original_date'], format=date_format).dt.strftime('%Y-%m-%d')
     else:
-        data_df['date'] = pd.to_datetime(data_df['original_date']).dt.strftime('%Y-%m-%d')
+        date_format = infer_date_format(data_df['original_date'], params['config_key'])
+    data_df['date'] = to_dates(data_df['original_date'], None if date_format is None else [date_format])
     return data_df
 
 def luxembourg_hospitalization_dates(data_df, params):
     format1 = '%Y-%m-%d %h:%m:%s'
     format2 = '%d/%m/%Y'
-    def fix_date(original):
-        try:
-            fixed = pd.to_datetime(original, format=format1).date().strftime('%Y-%m-%d')
-        except ValueError:
-            fixed = pd.to_datetime(original, format=format2).date().strftime('%Y-%m-%d')
-        return fixed
-    data_df['date'] = data_df['Date'].apply(fix_date)
+    data_df['date'] = to_dates(data_df['Date'], [format1, format2])
     return data_df
 
 def japan_hospitalization_dates(data_df, params):
@@ -56,7 +138,7 @@ def japan_hospitalization_dates(data_df, params):
     data_df['date'] = pd.to_datetime({
         'year': data_df['year'],
         'month': data_df['month'],
-        'day': data_df['day']}).dt.strftime('%Y-%m-%d')
+        'day': data_df['day']})
     return data_df
 
 def netherlands_hospitalization_dates(data_df, params):
@@ -65,8 +147,8 @@ def netherlands_hospitalization_dates(data_df, params):
         month_dict = {'feb': 2, 'mrt': 3, 'apr': 4, 'mei': 5, 'jun': 6}
         month = month_dict[month_str]
         year = 2020
-        return datetime.date(year, month, int(day_str)).strftime('%Y-%m-%d')
-    data_df['date'] = data_df['Datum ziekenhuisopname'].apply(fix_date)
+        return datetime.date(year, month, int(day_str))
+    data_df['date'] = pd.to_datetime(map_unique(data_df['Datum ziekenhuisopname'], fix_date))
     return data_df
 
 def iceland_dates(data_df, params):
@@ -76,13 +158,14 @@ def iceland_dates(data_df, params):
     def fix_date(original):
         day_str, month_str = str(original).split('.')
         year = 2020
-        return datetime.date(year, int(month_str), int(day_str)).strftime('%Y-%m-%d')
-    data_df['date'] = data_df['original_date'].apply(fix_date)
+        return datetime.date(year, int(month_str), int(day_str))
+    data_df['date'] = pd.to_datetime(map_unique(data_df['original_date'], fix_date))
     return data_df
 
 def scotland_hospitalizations_dates(data_df, params):
     data_df = data_df.rename(columns={
         data_df.columns[0]: 'original_date',
     })
-    data_df['date'] = pd.to_datetime(data_df['original_date']).dt.strftime('%Y-%m-%d')
+    date_format = infer_date_format(data_df['original_date'], params['config_key'])
+    data_df['date'] = to_dates(data_df['original_date'], None if date_format is None else [date_format])
     return data_df
@@ -13,40 +13,94 @@
 # limitations under the License.
 
 import logging
+import os
+import shutil
+import cache_utils
 import join_data
 import config
 import load_data
 import pandas as pd
 import numpy as np
+import path_utils
 import region_utils
 
 
-def export_data(config_dict=None, export_path=None):
+def export_data(config_dict=None, export_path=None, jobs=1):
     aggregated_config_dict = config.filter_by_aggregate_data(config_dict, aggregate_data=True)
     non_aggregated_config_dict = config.filter_by_aggregate_data(config_dict, aggregate_data=False)
-    export_aggregated_data(aggregated_config_dict, export_path)
-    export_non_aggregated_data(non_aggregated_config_dict, export_path)
+    export_aggregated_data(aggregated_config_dict, export_path, jobs)
+    export_non_aggregated_data(non_aggregated_config_dict, export_path, jobs)
 
-def export_aggregated_data(config_dict, export_path):
-    time_series_df = join_data.get_time_series_df(config_dict)
+# Rebuilds only the data types whose contributing sources changed since the
+# last export to export_path, as recorded in the export manifest. Data types
+# that did not change are read back from the frames cached by that export.
+# If nothing changed and the output is untouched, the export is skipped.
+def export_aggregated_data(config_dict, export_path, jobs=1):
+    data_types = join_data.time_series_data_types
+    manifest = cache_utils.read_export_manifest(export_path)
+    cache_dir = cache_utils.export_cache_dir(export_path)
+    signatures = {t: cache_utils.data_type_signature(t, config_dict) for t in data_types}
+    changed_types = [
+        t for t in data_types
+        if t not in manifest['data_types'] or manifest['data_types'][t]['signature'] != signatures[t]
+        or (manifest['data_types'][t]['has_data'] and not os.path.exists(os.path.join(cache_dir, t + '.parquet')))]
+    output_unchanged = (os.path.exists(export_path)
+                        and cache_utils.file_hash(export_path) == manifest['output_hash'])
+    if len(changed_types) == 0 and output_unchanged:
+        logging.info('No source changed since the last export to %s, skipping.', export_path)
+        return
+    logging.info('Rebuilding data types %s for %s.', changed_types, export_path)
+    loaded_data = load_data.load_data_types(changed_types, config_dict, jobs)
+    # Loading can discover new failing snapshots, which changes what each source resolves to.
+    signatures = {t: cache_utils.data_type_signature(t, config_dict) for t in data_types}
+    time_series_data_by_type = {}
+    manifest_data_types = {}
+    for data_type in data_types:
+        frame_path = os.path.join(cache_dir, data_type + '.parquet')
+        if data_type in changed_types:
+            df = loaded_data.get(data_type)
+            if df is None or cache_utils.write_cached(df, frame_path):
+                manifest_data_types[data_type] = {'signature': signatures[data_type], 'has_data': df is not None}
+        elif manifest['data_types'][data_type]['has_data']:
+            df = pd.read_parquet(frame_path)
+            manifest_data_types[data_type] = manifest['data_types'][data_type]
+        else:
+            df = None
+            manifest_data_types[data_type] = manifest['data_types'][data_type]
+        if df is not None:
+            time_series_data_by_type[data_type] = df
+    time_series_df = join_data.join_time_series_data(time_series_data_by_type)
     if time_series_df is None:
         logging.warning('time_series_df is None, will not export to %s. config_dict keys: %s',
                         export_path, config_dict.keys())
     else:
         time_series_df = time_series_df.rename(columns={'region_code': 'open_covid_region_code'})
-        time_series_df.to_csv(export_path, index=False)
+        # Dates stay datetime64 through the pipeline and are only formatted here.
+        time_series_df.to_csv(export_path, index=False, date_format='%Y-%m-%d')
+        path_utils.write_json(cache_utils.export_manifest_path(export_path), {
+            'output_hash': cache_utils.file_hash(export_path),
+            'data_types': manifest_data_types,
+        })
 
 # Hack: This function breaks most of the abstractions around load_functions
 # because the load function on non-aggregated data has side effects that directly
 # write the exported csv instead of returning it here.
-def export_non_aggregated_data(config_dict, export_path):
+def export_non_aggregated_data(config_dict, export_path, jobs=1):
     for source in config_dict.keys():
         config_dict[source]['export_path'] = export_path
+        config_dict[source]['export_jobs'] = jobs
         load_data.load_most_recent_loadable_data(config_dict[source])
     print(config_dict.keys())
 
-def write_csv_with_open_covid_region_code_added(input_path, output_path):
+# With chunksize set, streams the input in chunks of that many rows instead of
+# reading it whole; see stream_csv_with_open_covid_region_code_added.
+def write_csv_with_open_covid_region_code_added(input_path, output_path, chunksize=None):
     print('input path: ', input_path, ', output_path: ', output_path)
+    if chunksize is not None:
+        input_num_rows, output_num_rows = stream_csv_with_open_covid_region_code_added(
+            input_path, output_path, chunksize)
+        print('INPUT ROWS: ', input_num_rows, ', OUTPUT ROWS: ', output_num_rows)
+        return
     input_df = pd.read_csv(input_path)
     output_df = input_df.copy()
 
@@ -75,3 +129,37 @@ def write_csv_with_open_covid_region_code_added(input_path, output_path):
     output_columns = ['open_covid_region_code'] + list(input_df.columns)
     output_df = output_df[output_columns]
     output_df.to_csv(output_path, index=False)
+
+# Same output rows and row order as write_csv_with_open_covid_region_code_added
+# (country rows, then ISO 3166-2 rows, then FIPS rows), with memory bounded by
+# chunksize: each chunk's rows are appended to one temporary file per level,
+# and the three files are concatenated at the end. Values are read as strings
+# and copied through verbatim, so integer columns with gaps are not rewritten
+# as floats. Returns the number of input and output rows.
+def stream_csv_with_open_covid_region_code_added(input_path, output_path, chunksize):
+    input_columns = list(pd.read_csv(input_path, nrows=0).columns)
+    iso_3166_2_column = 'iso_3166_2_code' if 'iso_3166_2_code' in input_columns else 'sub_region_1_code'
+    fips_column = 'census_fips_code' if 'census_fips_code' in input_columns else 'sub_region_2_code'
+    part_paths = [f'{output_path}.part{i}.tmp' for i in range(3)]
+    input_num_rows = 0
+    output_num_rows = 0
+    try:
+        for part_path in part_paths:
+            with open(part_path, 'w'):
+                pass
+        for chunk in pd.read_csv(input_path, dtype=str, chunksize=chunksize):
+            input_num_rows += len(chunk)
+            parts = region_utils.mobility_region_code_parts(chunk, iso_3166_2_column, fips_column)
+            for part_path, part_df in zip(part_paths, parts):
+                part_df.to_csv(part_path, mode='a', header=False, index=False)
+                output_num_rows += len(part_df)
+        with open(output_path, 'w') as outfile:
+            pd.DataFrame(columns=['open_covid_region_code'] + input_columns).to_csv(outfile, index=False)
+            for part_path in part_paths:
+                with open(part_path) as infile:
+                    shutil.copyfileobj(infile, outfile)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return input_num_rows, output_num_rows
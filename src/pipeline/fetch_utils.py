@@ -0,0 +1,121 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import os
+import shutil
+
+import aiohttp
+
+import path_utils
+
+CHUNK_BYTES = 1 << 20
+TIMEOUT_SECONDS = 300
+
+
+def _conditional_headers(validator):
+    headers = {}
+    if validator is None:
+        return headers
+    if validator.get('etag'):
+        headers['If-None-Match'] = validator['etag']
+    if validator.get('last_modified'):
+        headers['If-Modified-Since'] = validator['last_modified']
+    return headers
+
+# Streams the body of a 200 response to out_path through a temporary file, so
+# a failed download never leaves a partial file behind.
+async def _write_body(resp, out_path):
+    tmp_path = out_path + '.download'
+    try:
+        with open(tmp_path, 'wb') as f:
+            async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                f.write(chunk)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _link_or_copy(src_path, dst_path):
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+
+# Fetches one download (see fetch_all) and returns its result dict.
+async def _fetch_one(session, download):
+    validator = download.get('validator')
+    previous_path = None
+    if validator is not None and validator['url'] == download['url']:
+        previous_path = path_utils.resolve_snapshot_file(os.path.join(path_utils.root_dir, validator['path']))
+    headers = _conditional_headers(validator if previous_path is not None else None)
+    out_path = download['out_path']
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    result = {'key': download['key'], 'status': 'failed', 'validator': validator}
+    try:
+        async with session.get(download['url'], headers=headers) as resp:
+            if resp.status == 200:
+                await _write_body(resp, out_path)
+                result['status'] = 'downloaded'
+                etag = resp.headers.get('ETag')
+                last_modified = resp.headers.get('Last-Modified')
+            elif resp.status == 304 and previous_path is not None:
+                if path_utils.is_blob_path(previous_path):
+                    path_utils.write_blob_pointer(out_path, os.path.basename(previous_path))
+                else:
+                    linked_path = out_path + path_utils.compressed_suffix(previous_path)
+                    if os.path.abspath(previous_path) != os.path.abspath(linked_path):
+                        _link_or_copy(previous_path, linked_path)
+                result['status'] = 'not_modified'
+                etag = resp.headers.get('ETag', validator.get('etag'))
+                last_modified = resp.headers.get('Last-Modified', validator.get('last_modified'))
+            else:
+                logging.error('Download failed for %s from %s: HTTP %d', download['key'], download['url'],
+                              resp.status)
+                return result
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        logging.error('Download failed for %s from %s: %s', download['key'], download['url'], repr(e))
+        return result
+    result['validator'] = {
+        'url': download['url'],
+        'path': os.path.relpath(out_path, path_utils.root_dir),
+        'etag': etag,
+        'last_modified': last_modified,
+    }
+    return result
+
+# Downloads each of downloads, a list of dicts with 'key', 'url', 'out_path'
+# and optionally 'validator' (the validator stored for that key by an earlier
+# run). At most max_concurrent connections are open at once, and they are kept
+# alive and reused per host. A download with a validator whose file still
+# exists is sent as a conditional GET; on 304 the previous file is linked (or
+# copied) to out_path instead of downloading it again, or if it is in the blob
+# store, a pointer to the same blob is written next to out_path.
+# Returns a list of {'key', 'status', 'validator'} in the order of downloads,
+# where status is 'downloaded', 'not_modified' or 'failed'.
+async def fetch_all(downloads, max_concurrent=8):
+    connector = aiohttp.TCPConnector(limit=max_concurrent)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT_SECONDS)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*[_fetch_one(session, download) for download in downloads])
+
+# Stored validators: {source key: {'url', 'path', 'etag', 'last_modified'}}.
+def read_validators():
+    return path_utils.read_json(path_utils.path_to('download_validators_json'), {})
+
+def write_validators(validators):
+    path_utils.write_json(path_utils.path_to('download_validators_json'), validators)
@@ -14,41 +14,92 @@
 
 import logging
 import pandas as pd
-import os
 
 import load_data
 import config
-
-LOCATIONS_PATH = os.path.join(
-    os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')), 'data/exports/locations/locations.csv')
+import region_utils
 
 time_series_data_types = config.get_time_series_data_types()
+key_columns = ['date', 'region_code']
+# Per-capita column formats in data.yaml, as {suffix: people per unit}. Each is
+# computed from the format without the suffix, e.g. new_per_million from new.
+per_capita_scales = {'_per_million': 1e6, '_per_thousand': 1e3}
+
+def get_time_series_data_by_type(config_dict, jobs=1):
+    return load_data.load_data_types(time_series_data_types, config_dict, jobs)
 
-def get_time_series_data_by_type(config_dict):
-    time_series_data = {}
-    for data_type in time_series_data_types:
-        data_type_data = load_data.load_data_type(data_type, config_dict)
-        if data_type_data is not None:
-            time_series_data[data_type] = data_type_data
-    return time_series_data
+def get_time_series_df(config_dict, jobs=1):
+    return join_time_series_data(get_time_series_data_by_type(config_dict, jobs))
 
-def get_time_series_df(config_dict):
+# Joins the per-type frames with a chain of pairwise outer merges on the keys.
+def merge_time_series_frames(frames):
     joined_df = None
-    time_series_data_by_type = get_time_series_data_by_type(config_dict)
-    for df in time_series_data_by_type.values():
+    for df in frames:
         if joined_df is None:
             joined_df = df
         else:
-            joined_df = joined_df.merge(df, on=['date', 'region_code'], how='outer')
-    if joined_df is None:
+            joined_df = joined_df.merge(df, on=key_columns, how='outer')
+    return joined_df
+
+# Joins the per-type frames in a single pass: builds one index of every key in
+# order of first appearance, then reindexes each frame onto it. This yields the
+# same rows, row order and columns as merge_time_series_frames, provided every
+# frame has unique, non-null keys and the frames share no data columns.
+def align_time_series_frames(frames):
+    keys = pd.concat([df[key_columns] for df in frames], ignore_index=True).drop_duplicates()
+    key_index = pd.MultiIndex.from_frame(keys)
+    aligned = [keys.reset_index(drop=True)]
+    for df in frames:
+        aligned.append(df.set_index(key_columns).reindex(key_index).reset_index(drop=True))
+    return pd.concat(aligned, axis=1)
+
+def can_align(frames):
+    data_columns = [c for df in frames for c in df.columns if c not in key_columns]
+    if len(data_columns) != len(set(data_columns)):
+        return False
+    for df in frames:
+        if df[key_columns].isna().any().any() or df.duplicated(subset=key_columns).any():
+            return False
+    return True
+
+# Joins a dict from data type to its loaded frame into the final time series.
+def join_time_series_data(time_series_data_by_type):
+    frames = list(time_series_data_by_type.values())
+    if len(frames) == 0:
         logging.warning('No dataframe loaded for any data type, get_time_series_df returning None.')
         return None
+    if can_align(frames):
+        joined_df = align_time_series_frames(frames)
     else:
-        location_names_df = pd.read_csv(LOCATIONS_PATH)
-        location_names_df = location_names_df[['region_code', 'region_name']]
-        time_series_df = joined_df.merge(location_names_df, on=['region_code'], how='inner')
-        identifier_cols = ['region_code', 'region_name', 'date']
-        time_series_df_cols = [c for c in time_series_df.columns if c not in identifier_cols]
-        time_series_df = time_series_df[identifier_cols + time_series_df_cols]
-        time_series_df.sort_values(by=['region_code', 'date'])
+        logging.warning('Duplicate or missing date/region_code keys, joining data types with pairwise merges.')
+        joined_df = merge_time_series_frames(frames)
+    location_names_df = region_utils.get_location_index().region_names()
+    time_series_df = joined_df.merge(location_names_df, on=['region_code'], how='inner')
+    identifier_cols = ['region_code', 'region_name', 'date']
+    time_series_df_cols = [c for c in time_series_df.columns if c not in identifier_cols]
+    time_series_df = time_series_df[identifier_cols + time_series_df_cols]
+    time_series_df.sort_values(by=['region_code', 'date'])
+    return add_per_capita_columns(time_series_df)
+
+# Fills every per-capita column in data.yaml whose base column is present from
+# the populations in the location index. Values shipped by a source are kept;
+# only the gaps are computed. Does nothing if no population table is loaded.
+def add_per_capita_columns(time_series_df):
+    location_index = region_utils.get_location_index()
+    if not location_index.has_population:
         return time_series_df
+    population = location_index.populations(time_series_df['region_code'])
+    for data_type in config.read_data_schema().values():
+        columns = data_type['columns']
+        for column_format, per_capita_col in columns.items():
+            for suffix, scale in per_capita_scales.items():
+                base_col = columns.get(column_format[:-len(suffix)])
+                if not column_format.endswith(suffix) or base_col not in time_series_df:
+                    continue
+                per_capita = pd.to_numeric(time_series_df[base_col], errors='coerce').to_numpy() / population * scale
+                if per_capita_col in time_series_df:
+                    time_series_df[per_capita_col] = time_series_df[per_capita_col].fillna(pd.Series(
+                        per_capita, index=time_series_df.index))
+                else:
+                    time_series_df[per_capita_col] = per_capita
+    return time_series_df
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import logging
 import pandas as pd
 
+import cache_utils
 import load_functions
 import config
 import path_utils
@@ -23,48 +25,151 @@ import path_utils
 data_columns_by_type = config.get_data_columns_by_type()
 identifier_columns = config.get_identifier_columns()
 
-def load_most_recent_loadable_data(params):
+# Run-scoped cache of loaded source frames, keyed by (config_key, snapshot path).
+# Export runs load the same source once per license tier, so anything already
+# parsed and region-joined for one tier is reused by the others. Snapshots that
+# failed to load are remembered too, so they are not re-parsed for each tier.
+_source_cache = {}
+_failed_snapshots = set()
+
+def clear_source_cache():
+    _source_cache.clear()
+    _failed_snapshots.clear()
+
+# Returns the snapshots that still need a load attempt, newest first, along with
+# the cached frame to fall back on if none of them load. Snapshots older than
+# the newest cached one are never tried, same as in the sequential walk.
+def _pending_snapshots(params):
+    config_key = params['config_key']
+    pending = []
+    for data_dict in path_utils.all_data_most_to_least_recent(params):
+        cache_key = (config_key, data_dict['path'])
+        if cache_key in _source_cache:
+            return pending, _source_cache[cache_key]
+        if cache_key not in _failed_snapshots:
+            pending.append(data_dict)
+    return pending, None
+
+# Tries each snapshot in turn and stops at the first one that loads.
+# Returns (df, loaded path, failed paths). Only touches its arguments, so it
+# can run in a worker process.
+def _load_first_loadable(params, data_dicts):
     config_key = params['config_key']
     load_func_name = params['load']['function']
     load_func = getattr(load_functions, load_func_name)
-    all_data_sorted = path_utils.all_data_most_to_least_recent(params)
-    df = None
-    for data_dict in all_data_sorted:
+    failed_paths = []
+    for data_dict in data_dicts:
         data_path = data_dict['path']
         data_date = data_dict['date']
+        known_error = cache_utils.known_load_failure(data_path, params)
+        if known_error is not None:
+            # The status is keyed on the snapshot's content hash, so the failure
+            # may have come from an identical snapshot earlier in this run.
+            logging.warning('Skipping source %s for date %s: a snapshot with the same content hash already '
+                            'failed to load with this config, load code and library versions', config_key, data_date)
+            logging.warning('    with Exception: %s', known_error)
+            failed_paths.append(data_path)
+            continue
         try:
-            df = load_func(data_path, params)
+            df = cache_utils.cached_load(load_func, data_path, params)
             logging.warning('Loading succeeded on source %s for date %s', config_key, data_date)
-            break
+            cache_utils.record_load_status(data_path, params)
+            return df, data_path, failed_paths
         except Exception as e:  # pylint: disable=broad-except
             logging.warning('Loading failed on source %s for date %s', config_key, data_date)
             logging.warning('    with Exception: %s', str(e))
+            if isinstance(e, cache_utils.ENVIRONMENT_ERRORS):
+                logging.warning('    which may come from the environment, so it is not recorded.')
+            else:
+                cache_utils.record_load_status(data_path, params, error=str(e))
+            failed_paths.append(data_path)
             continue
+    return None, None, failed_paths
+
+def _record_load(params, load_result, cached_df):
+    config_key = params['config_key']
+    df, loaded_path, failed_paths = load_result
+    for data_path in failed_paths:
+        _failed_snapshots.add((config_key, data_path))
+    if loaded_path is None:
+        df = cached_df
+    # Load functions with side effects (e.g. google_load_function) return None
+    # and must run every time, so only cache actual frames.
+    elif df is not None:
+        _source_cache[(config_key, loaded_path)] = df
     if df is None:
         logging.error(
             'Loading failed for all subdirs for source %s. load_most_recent_loadable_data will return None.',
             config_key)
     return df
 
-def load_data_type(data_type, config_dict):
-    list_of_dfs = []
+def load_most_recent_loadable_data(params):
+    pending, cached_df = _pending_snapshots(params)
+    return _record_load(params, _load_first_loadable(params, pending), cached_df)
+
+def _init_worker(root_dir):
+    path_utils.root_dir = root_dir
+
+# Loads every source in params_list and returns the frames in the same order.
+# With jobs > 1 the load functions run in a pool of worker processes; the
+# results are still recorded in this process's cache.
+def load_sources(params_list, jobs=1):
+    if jobs <= 1:
+        return [load_most_recent_loadable_data(params) for params in params_list]
+    pending_list = [_pending_snapshots(params) for params in params_list]
+    load_results = [(None, None, [])] * len(params_list)
+    to_load = [i for i, (pending, _) in enumerate(pending_list) if len(pending) > 0]
+    if len(to_load) > 0:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(to_load)),
+                                                    initializer=_init_worker,
+                                                    initargs=(path_utils.root_dir,)) as executor:
+            results = executor.map(_load_first_loadable,
+                                   [params_list[i] for i in to_load],
+                                   [pending_list[i][0] for i in to_load])
+            for i, load_result in zip(to_load, results):
+                load_results[i] = load_result
+        # The workers recorded load statuses for these sources on disk.
+        for i in to_load:
+            cache_utils.forget_load_statuses(params_list[i])
+    return [_record_load(params, load_result, cached_df)
+            for params, load_result, (_, cached_df) in zip(params_list, load_results, pending_list)]
+
+def select_data_type(df, data_type, params):
+    columns_to_keep = identifier_columns + data_columns_by_type[data_type]
+    df = df[df.columns[df.columns.isin(columns_to_keep)]]
+    load_params = params['load']
+    if 'regions' in load_params and 'omit' in load_params['regions']:
+        omit_params = load_params['regions']['omit']
+        if data_type in omit_params:
+            omit_regions = omit_params[data_type]
+            df = df[~df.region_code.isin(omit_regions)]
+    return df
+
+# Loads each source in config_dict at most once and slices the loaded frame
+# into every requested data type it provides. Returns a dict from data type to
+# the concatenated frame for that type; data types with no data are left out.
+def load_data_types(data_types, config_dict, jobs=1):
+    dfs_by_type = {data_type: [] for data_type in data_types}
+    params_list = []
     for k in config_dict:
         params = config_dict[k]
-        if 'data' in params and data_type in params['data']:
-            df = load_most_recent_loadable_data(params)
-            if df is not None:
-                columns_to_keep = identifier_columns + data_columns_by_type[data_type]
-                df = df[df.columns[df.columns.isin(columns_to_keep)]]
-                load_params = params['load']
-                if 'regions' in load_params and 'omit' in load_params['regions']:
-                    omit_params = load_params['regions']['omit']
-                    if data_type in omit_params:
-                        omit_regions = omit_params[data_type]
-                        df = df[~df.region_code.isin(omit_regions)]
-                list_of_dfs.append(df)
-    if len(list_of_dfs) > 0:
-        joined = pd.concat(list_of_dfs)
-        return joined
-    else:
-        logging.info('Data type %s did not load any data. load_data_type will return None.', data_type)
+        if 'data' in params and any(data_type in params['data'] for data_type in data_types):
+            params_list.append(params)
+    for params, df in zip(params_list, load_sources(params_list, jobs)):
+        if df is not None:
+            for data_type in data_types:
+                if data_type in params['data']:
+                    dfs_by_type[data_type].append(select_data_type(df, data_type, params))
+    data_by_type = {}
+    for data_type, list_of_dfs in dfs_by_type.items():
+        if len(list_of_dfs) > 0:
+            data_by_type[data_type] = pd.concat(list_of_dfs)
+        else:
+            logging.info('Data type %s did not load any data. load_data_types will leave it out.', data_type)
+    return data_by_type
+
+def load_data_type(data_type, config_dict, jobs=1):
+    data_by_type = load_data_types([data_type], config_dict, jobs)
+    if data_type not in data_by_type:
         return None
+    return data_by_type[data_type]
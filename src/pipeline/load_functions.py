@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pandas as pd
-import numpy as np
+import concurrent.futures
 import logging
 import os
+import time
 
+import cache_utils
 import region_utils
 import load_utils
 import date_utils
@@ -36,7 +37,10 @@ def default_load_function(data_path, params):
     if 'regions' in load_params:
         if 'aggregate_by' in load_params['regions']:
             df = region_utils.aggregate_and_append(df, params)
-    df = load_utils.compute_cumulative_from_new(df, params)
+    # Transforms move values between column formats, so columns are derived
+    # from the formats as they stand after the transforms.
+    df = load_utils.apply_transforms(df, params)
+    df = load_utils.derive_data_columns(df, params)
     return df
 
 def nytimes_load_function(data_path, params):
@@ -49,7 +53,28 @@ def mobility_load_function(data_path, params):
     df = region_utils.join_mobility_region_codes(df, params)
     return df
 
+# Rows per chunk when annotating the Google exports, which are too large to
+# hold several copies of in memory.
+GOOGLE_EXPORT_CHUNK_ROWS = 100000
+
+def _init_annotation_worker(root_dir):
+    path_utils.root_dir = root_dir
+    region_utils.get_location_index()
+
+# Annotates one Google export file; returns (seconds, input rows, output rows).
+def _annotate_google_file(input_path, output_path):
+    start = time.perf_counter()
+    input_num_rows, output_num_rows = export_utils.stream_csv_with_open_covid_region_code_added(
+        input_path, output_path, GOOGLE_EXPORT_CHUNK_ROWS)
+    return time.perf_counter() - start, input_num_rows, output_num_rows
+
 # This function has side effects (writing to the export directory)
+# Every csv under the snapshot is annotated with region codes into the export
+# directory, except files whose source and output are unchanged since the last
+# run according to the directory's annotation manifest. With
+# params['export_jobs'] > 1 the files are spread over a pool of worker
+# processes, which start with the location index already loaded here, and a
+# timing summary is printed once all files are done.
 def google_load_function(data_path, params):
     input_dir = os.path.dirname(data_path)
     if 'export_path' in params:
@@ -58,57 +83,54 @@ def google_load_function(data_path, params):
         export_dir = os.path.join(path_utils.path_to('export_dir'), params['config_key'])
     print('input dir: ', input_dir)
     print('export dir: ', export_dir)
+    rel_paths = []
     for path, subdirs, files in os.walk(input_dir):
-        print('path: ', path)
         for subdir in subdirs:
-            print('subdir: ', subdir)
             export_subdir_path = os.path.join(export_dir,
                                               os.path.relpath(os.path.join(path, subdir), start=input_dir))
             if not os.path.exists(export_subdir_path):
                 print('making subdir: ', export_subdir_path)
                 os.makedirs(export_subdir_path)
         for file in files:
-            file_path = os.path.join(path, file)
-            print('file_path: ', file_path)
-            rel_path = os.path.relpath(file_path, start=input_dir)
-            print('rel path: ', rel_path)
-            export_path = os.path.join(export_dir, rel_path)
             if os.path.basename(file).endswith('.csv'):
-                export_utils.write_csv_with_open_covid_region_code_added(file_path, export_path)
+                rel_paths.append(os.path.relpath(os.path.join(path, file), start=input_dir))
+    manifest = cache_utils.read_annotation_manifest(export_dir)
+    version = cache_utils.annotation_version()
+    entries = manifest['files'] if manifest['version'] == version else {}
+    unchanged_paths = set(
+        rel_path for rel_path in rel_paths
+        if cache_utils.annotation_is_current(entries.get(rel_path), os.path.join(input_dir, rel_path),
+                                             os.path.join(export_dir, rel_path)))
+    if len(unchanged_paths) > 0:
+        print(f'Skipping {len(unchanged_paths)} files unchanged since the last export.')
+    rel_paths = [rel_path for rel_path in rel_paths if rel_path not in unchanged_paths]
+    input_paths = [os.path.join(input_dir, rel_path) for rel_path in rel_paths]
+    export_paths = [os.path.join(export_dir, rel_path) for rel_path in rel_paths]
+    jobs = min(params.get('export_jobs', 1), len(rel_paths))
+    start = time.perf_counter()
+    if jobs <= 1:
+        results = list(map(_annotate_google_file, input_paths, export_paths))
+    else:
+        region_utils.get_location_index()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    initializer=_init_annotation_worker,
+                                                    initargs=(path_utils.root_dir,)) as executor:
+            results = list(executor.map(_annotate_google_file, input_paths, export_paths))
+    print(f'Annotated {len(rel_paths)} files in {time.perf_counter() - start:.1f}s, jobs={max(jobs, 1)}:')
+    for rel_path, (seconds, input_num_rows, output_num_rows) in zip(rel_paths, results):
+        print(f'  {rel_path}: {seconds:.2f}s, {input_num_rows} input rows, {output_num_rows} output rows')
+    files = {rel_path: entries[rel_path] for rel_path in unchanged_paths}
+    for rel_path, input_path, export_path in zip(rel_paths, input_paths, export_paths):
+        files[rel_path] = cache_utils.annotation_entry(input_path, export_path)
+    updated_manifest = {'version': version, 'files': files}
+    if updated_manifest != manifest:
+        path_utils.write_json(cache_utils.annotation_manifest_path(export_dir), updated_manifest)
 
 def covidtracking(data_path, params):
     data_df = default_load_function(data_path, params)
     data_df = data_df.reindex(index=data_df.index[::-1])
     return data_df
 
-# Note: we only include regions that are computing cumulative hospitalizations
-# and don't compute a country-level hospitalization number for Spain
-# pylint: disable=bad-continuation
-def spain_and_regions(data_path, params):
-    data_df = default_load_function(data_path, params)
-    data_df['hospitalized_current'] = data_df.apply(
-        lambda row: (row['hospitalized_cumulative']
-            if ((row['local_alpha_code'] == 'CM' and row['date'] < '2020-04-11')
-                or (row['local_alpha_code'] == 'MD' and row['date'] < '2020-04-26'))
-            else np.nan), axis=1
-    )
-    data_df['hospitalized_cumulative'] = data_df.apply(
-        lambda row: row['hospitalized_cumulative'] if pd.isnull(row['hospitalized_current']) else np.nan, axis=1
-    )
-    data_df['icu_current'] = data_df.apply(
-        lambda row: (row['icu_cumulative']
-            if ((row['local_alpha_code'] == 'CL' and row['date'] < '2020-04-17')
-                or (row['local_alpha_code'] == 'GA' and row['date'] < '2020-04-28')
-                or (row['local_alpha_code'] == 'CM' and row['date'] < '2020-04-12')
-                or (row['local_alpha_code'] == 'MD' and row['date'] < '2020-04-26'))
-            else np.nan), axis=1
-    )
-    data_df['icu_cumulative'] = data_df.apply(
-        lambda row: row['icu_cumulative'] if pd.isnull(row['icu_current']) else np.nan, axis=1
-    )
-    return data_df
-# pylint: enable=bad-continuation
-
 def japan_hospitalizations(data_path, params):
     data_df = load_utils.default_read_function(data_path, params)
     data_df['deaths_cumulative'] = data_df['deaths_cumulative'].replace(to_replace='-', value=0).astype('int32')
@@ -116,19 +138,10 @@ def japan_hospitalizations(data_path, params):
     data_df = region_utils.aggregate_and_append(data_df, params)
     return data_df
 
-def netherlands_hospitalizations(data_path, params):
-    df = default_load_function(data_path, params)
-    df = df.rename(columns={
-        'nieuw': 'new_reports',
-        'tot en met gisteren': 'reported_through_yesterday'
-    })
-    df['hospitalized_current'] = df['new_reports'] + df['reported_through_yesterday']
-    return df
-
 # Tricky because hospitalization data for scotland data comes from UK
 # data source, but ICU data comes from here. Make sure they get joined correctly.
 def scotland_hospitalizations(data_path, params):
-    df = pd.read_excel(data_path, 'Table 2 - Hospital Care', skiprows=4)
+    df = cache_utils.read_excel_cached(data_path, sheet_name='Table 2 - Hospital Care', skiprows=4)
     df = df.rename(columns={
         df.columns[1]: 'icu_current',
         df.columns[4]: 'hospitalized_current',
@@ -12,8 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+
+import numpy as np
 import pandas as pd
 
+import cache_utils
 import config
 import date_utils
 
@@ -23,6 +27,40 @@ def rename_data_columns(data_df, params):
     data_df = data_df.rename(columns=rename_dict)
     return data_df
 
+# Load functions that use nothing from the source file besides the columns
+# declared in its config, so the reader can skip every other column.
+COLUMN_PRUNED_LOAD_FUNCTIONS = ['default_load_function', 'covidtracking']
+
+# Returns the set of source file columns the config refers to (data, date,
+# region mapping and transform columns), or None if the load or date parse
+# function may read columns the config doesn't name.
+def source_columns(params):
+    load_params = params['load']
+    if (load_params['function'] not in COLUMN_PRUNED_LOAD_FUNCTIONS
+            or load_params['dates']['parse_function'] != 'default'):
+        return None
+    columns = set(load_params['dates']['columns'])
+    for formats in params['data'].values():
+        columns.update(c for c in formats.values() if c != 'None')
+    if 'regions' in load_params and 'mapping_keys' in load_params['regions']:
+        columns.update(load_params['regions']['mapping_keys'].values())
+    for transform in load_params.get('transforms', []):
+        columns.update(transform.get('sum_columns', []))
+    return columns
+
+# Reads sheet_names (every sheet if None) from the workbook at path, opening and
+# parsing the workbook once rather than once per sheet. Returns
+# {sheet name: DataFrame}; sheets missing from the workbook are logged and left
+# out. read_args are passed to the parse of each sheet.
+def read_workbook_sheets(path, sheet_names=None, **read_args):
+    with pd.ExcelFile(path) as workbook:
+        if sheet_names is None:
+            sheet_names = workbook.sheet_names
+        for sheet_name in sheet_names:
+            if sheet_name not in workbook.sheet_names:
+                logging.error('Sheet %s is missing from %s: skipping.', sheet_name, path)
+        return workbook.parse([s for s in sheet_names if s in workbook.sheet_names], **read_args)
+
 def default_read_function(data_path, params):
     read_params = None
     if 'read' in params['load']:
@@ -37,24 +75,74 @@ def default_read_function(data_path, params):
         for k in read_args.keys():
             if k in read_params:
                 read_args[k] = read_params[k]
+    columns = source_columns(params)
     if file_extension == 'csv':
+        usecols = None if columns is None else columns.__contains__
         data_df = pd.read_csv(data_path, delimiter=read_args['delimiter'], encoding=read_args['encoding'],
-                              skipfooter=read_args['skipfooter'])
+                              skipfooter=read_args['skipfooter'], usecols=usecols)
     elif file_extension == 'xlsx':
-        data_df = pd.read_excel(data_path, sheet_name=read_args['sheet_name'], skiprows=read_args['skiprows'],
-                                skipfooter=read_args['skipfooter'])
+        data_df = cache_utils.read_excel_cached(data_path, columns, sheet_name=read_args['sheet_name'],
+                                                skiprows=read_args['skiprows'], skipfooter=read_args['skipfooter'])
     data_df = date_utils.parse_date(data_df, params)
     data_df = rename_data_columns(data_df, params)
 
     return data_df
 
-def compute_cumulative_from_new(df, params):
-    data_columns = params['data']
+# Column formats that can be derived from another format of the same data type,
+# as {derived format: (source format, kernel)}. Formats not listed here (e.g.
+# current) are only ever read from the source.
+DERIVED_FORMATS = {
+    'cumulative': ('new', 'cumsum'),
+    'new': ('cumulative', 'diff'),
+}
+
+# Fills every column format in DERIVED_FORMATS that the source does not provide
+# but can be derived from one it does. The rows are sorted by date once and all
+# derived columns share that order:
+# - cumsum: running total of the source column per region.
+# - diff: change in the source column since the region's previous row, left
+#   empty unless that row is for the previous day.
+def derive_data_columns(df, params):
     schema = config.read_data_schema()
-    for data_type in data_columns.keys():
-        formats = data_columns[data_type]
-        if 'new' in formats and 'cumulative' not in formats:
-            cum_col_name = schema[data_type]['columns']['cumulative']
-            new_col_name = schema[data_type]['columns']['new']
-            df[cum_col_name] = df.sort_values('date').groupby('region_code')[new_col_name].apply(lambda x: x.cumsum())
+    derivations = []
+    for data_type, formats in params['data'].items():
+        schema_columns = schema[data_type]['columns']
+        for derived_format, (source_format, kernel) in DERIVED_FORMATS.items():
+            if derived_format in schema_columns and source_format in formats and derived_format not in formats:
+                derivations.append((schema_columns[derived_format], schema_columns[source_format], kernel))
+    if len(derivations) == 0:
+        return df
+    order = np.argsort(df['date'].to_numpy(), kind='mergesort')
+    sorted_df = df.iloc[order]
+    grouped = sorted_df.groupby('region_code', observed=True, sort=False)
+    follows_previous_day = (grouped['date'].diff() == pd.Timedelta(days=1)).to_numpy()
+    for derived_col, source_col, kernel in derivations:
+        if kernel == 'cumsum':
+            values = grouped[source_col].cumsum().to_numpy()
+        else:
+            values = np.where(follows_previous_day, grouped[source_col].diff().to_numpy(), np.nan)
+        derived = np.empty_like(values)
+        derived[order] = values
+        df[derived_col] = derived
+    return df
+
+# Applies the load.transforms rules from the source config, in order:
+# - sum_columns: sets to_column to the sum of the listed columns.
+# - from_column: moves values from from_column to to_column on the rows of each
+#   region in regions_before_date (matched on region_column) dated before its cutoff.
+def apply_transforms(df, params):
+    if 'transforms' not in params['load']:
+        return df
+    for transform in params['load']['transforms']:
+        to_column = transform['to_column']
+        if 'sum_columns' in transform:
+            df[to_column] = df[transform['sum_columns']].sum(axis=1, skipna=False)
+        else:
+            from_column = transform['from_column']
+            cutoffs = pd.to_datetime(df[transform['region_column']].map(transform['regions_before_date']))
+            mask = df['date'] < cutoffs
+            if to_column not in df:
+                df[to_column] = np.nan
+            df[to_column] = df[to_column].where(~mask, df[from_column])
+            df[from_column] = df[from_column].where(~mask)
     return df
@@ -13,15 +13,23 @@
 # limitations under the License.
 
 import datetime
+import json
 import logging
 import os
+import time
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
 
 _resources = dict(
     about_md='docs/about.md',
+    blob_store_dir='data/inputs/blobs',
+    cache_dir='.cache',
+    date_formats_dir='.cache/date_formats',
     debug_dir='src/views/debug',
+    download_validators_json='data/inputs/downloaded/download_validators.json',
     downloaded_dir='data/inputs/downloaded',
+    excel_cache_dir='.cache/excel',
+    export_cache_dir='.cache/exports',
     export_cc_by_csv='data/exports/cc_by/aggregated_cc_by.csv',
     export_cc_by_license='data/exports/cc_by/LICENSE',
     export_cc_by_nc_csv='data/exports/cc_by_nc/aggregated_cc_by_nc.csv',
@@ -35,11 +43,14 @@ _resources = dict(
     export_search='data/exports/search_trends_symptoms_dataset',
     export_mobility='data/exports/google_mobility_reports/Regions',
     inputs_dir='data/inputs',
+    load_status_dir='.cache/load_status',
     locations_csv='data/exports/locations/locations.csv',
     locations_export_dir='data/exports/locations',
     locations_input_dir='data/inputs/static/locations/raw',
     locations_intermediate_dir='data/inputs/static/locations/intermediate',
     main_dir='src/views/main',
+    parse_cache_dir='.cache/parsed',
+    population_csv='data/inputs/static/locations/population.csv',
     readme_md='README.md',
     schema_yaml='src/config/schema.yaml',
     scraped_dir='data/inputs/scraped',
@@ -78,9 +89,7 @@ def get_data_directory_path(params):
 
 def has_data_from_date(params, date):
     path_to_data = path_to_data_for_date(params, date)
-    path_dir = path_to_data['dir']
-    path_file = path_to_data['file']
-    return os.path.exists(os.path.join(path_dir, path_file))
+    return get_snapshot_catalog().resolve(path_to_data['dir'], path_to_data['file']) is not None
 
 def path_to_data_for_date(params, date):
     directory_path, file_name = get_data_directory_path(params)
@@ -90,32 +99,220 @@ def all_data_most_to_least_recent(params):
     directory_path, file_name = get_data_directory_path(params)
     return all_subdirs_most_to_least_recent(directory_path, file_name)
 
+# Returns a list of {'path', 'date', 'size', 'hash'} for the dated
+# subdirectories of directory_path holding file_name, most recent first. If
+# file_name is None every dated subdirectory is listed, with the subdirectory
+# as its path. See SnapshotCatalog.snapshots.
 def all_subdirs_most_to_least_recent(directory_path, file_name):
+    return get_snapshot_catalog().snapshots(directory_path, file_name)
+
+# Snapshot files can be stored in the content-addressed blob store, with the
+# dated directory holding a pointer file (the snapshot's name plus
+# BLOB_POINTER_SUFFIX) whose only content is the blob name. Blobs are named by
+# the sha256 of their content plus the snapshot's extension, and are kept
+# under blob_store_dir in subdirectories named by the first two characters.
+BLOB_POINTER_SUFFIX = '.blobref'
+# A snapshot file can also be stored compressed, as its name plus one of these
+# suffixes. pandas decompresses them based on the suffix.
+COMPRESSED_SUFFIXES = ['.gz', '.zst']
+
+def blob_path(blob_name):
+    return os.path.join(path_to('blob_store_dir'), blob_name[:2], blob_name)
+
+def is_blob_path(path):
+    return os.path.dirname(os.path.dirname(os.path.abspath(path))) == os.path.abspath(path_to('blob_store_dir'))
+
+# Returns the path to read for the snapshot file at path, trying path itself
+# and then its compressed variants, each either as a file or as a pointer to
+# a blob. Returns None if there is no such file.
+def resolve_snapshot_file(path):
+    for candidate_path in [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES]:
+        if os.path.exists(candidate_path):
+            return candidate_path
+        pointer_path = candidate_path + BLOB_POINTER_SUFFIX
+        if os.path.exists(pointer_path):
+            with open(pointer_path) as f:
+                resolved_path = blob_path(f.read().strip())
+            if os.path.exists(resolved_path):
+                return resolved_path
+            logging.warning('Snapshot pointer %s names a missing blob %s: skipping.', pointer_path, resolved_path)
+    return None
+
+# Returns the compression suffix of path, or '' if it is not compressed.
+def compressed_suffix(path):
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ''
+
+# The pointer is written to a temporary file and moved into place, so that its
+# directory's mtime changes even when an existing pointer is rewritten (see
+# SnapshotCatalog).
+def write_blob_pointer(path, blob_name):
+    pointer_path = path + BLOB_POINTER_SUFFIX
+    with open(pointer_path + '.tmp', 'w') as f:
+        f.write(blob_name + '\n')
+    os.replace(pointer_path + '.tmp', pointer_path)
+
+# Contents of the JSON file at path, or default if it is missing or unreadable.
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
     try:
-        _, subdirs, _ = next(os.walk(directory_path))
-    except StopIteration:
-        logging.warning('No subdirectories found for directory_path %s: skipping.', directory_path)
-        subdirs = []
-    subdirs_that_are_dates = []
-    for sd in subdirs:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning('Ignoring unreadable JSON file %s', path)
+        return default
+
+# Writes data to path as JSON through a temporary file named after the process,
+# so readers and other processes writing the same file never see a partial one.
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Listings of directories modified less than this long before they were
+# scanned are scanned again on their next use, since a change in the same
+# filesystem timestamp tick would not change the mtime.
+RACY_LISTING_NS = 2 * 10**9
+
+
+class SnapshotCatalog:
+    """Cached listings of the snapshot directories under inputs_dir.
+
+    The catalog is built from one scan of inputs_dir, which lists each source
+    directory (inputs_dir/<fetch method>/<source>), each dated subdirectory in
+    them and the blob store. Every listing keeps the mtime of its directory
+    and is only listed again when that mtime changes, which happens whenever
+    an entry is added, removed or renamed in the directory, so lookups after
+    the first scan cost one stat per directory. Files rewritten in place keep
+    their directory's mtime, which is why snapshots and pointers are always
+    written to a temporary file and moved into place.
+    """
+
+    def __init__(self, inputs_dir):
+        self.inputs_dir = inputs_dir
+        self._listings = {}
+        for fetch_dir in self._subdir_paths(inputs_dir):
+            for source_dir in self._subdir_paths(fetch_dir):
+                for subdir in self._subdir_paths(source_dir):
+                    self._listing(subdir)
+
+    def _subdir_paths(self, dir_path):
+        listing = self._listing(dir_path)
+        if listing is None:
+            return []
+        return [os.path.join(dir_path, name) for name in sorted(listing['subdirs'])]
+
+    # Returns the listing of dir_path, or None if it is not a directory.
+    def _listing(self, dir_path):
         try:
-            sd_date = datetime.datetime.strptime(sd, '%Y-%m-%d').date()
-            subdirs_that_are_dates.append(sd_date)
-        except ValueError:
-            continue
-    # Sorted most recent to least recent
-    sorted_subdir_dates = sorted(subdirs_that_are_dates, reverse=True)
-    sorted_subdir_paths_with_data = []
-    # Iterate from most recent to least recent, if you find
-    # a subdir containing the correct filename then append to return value
-    for subdir_date in sorted_subdir_dates:
-        date_str = subdir_date.strftime('%Y-%m-%d')
-        path_to_file = os.path.join(directory_path, date_str, file_name)
-        if os.path.exists(path_to_file) or file_name is None:
-            subdir_dict = {'path': path_to_file, 'date': subdir_date}
-            sorted_subdir_paths_with_data.append(subdir_dict)
-    # If you never found a subdir with this file, will return an empty list
-    return sorted_subdir_paths_with_data
+            mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            self._listings.pop(dir_path, None)
+            return None
+        listing = self._listings.get(dir_path)
+        if listing is None or listing['mtime'] != mtime or listing['scanned'] - mtime < RACY_LISTING_NS:
+            listing = self._scan(dir_path, mtime)
+            self._listings[dir_path] = listing
+        return listing
+
+    @staticmethod
+    def _scan(dir_path, mtime):
+        listing = {'mtime': mtime, 'scanned': time.time_ns(), 'subdirs': set(), 'dates': [], 'files': {},
+                   'pointers': {}}
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.is_dir():
+                listing['subdirs'].add(entry.name)
+                try:
+                    subdir_date = datetime.datetime.strptime(entry.name, '%Y-%m-%d').date()
+                except ValueError:
+                    continue
+                if subdir_date.strftime('%Y-%m-%d') == entry.name:
+                    listing['dates'].append((subdir_date, entry.name))
+            elif entry.name.endswith(BLOB_POINTER_SUFFIX):
+                with open(entry.path) as f:
+                    listing['pointers'][entry.name[:-len(BLOB_POINTER_SUFFIX)]] = f.read().strip()
+            elif entry.is_file():
+                listing['files'][entry.name] = entry.stat().st_size
+        # Sorted most recent to least recent
+        listing['dates'].sort(reverse=True)
+        return listing
+
+    # Same lookup as resolve_snapshot_file, for file_name in dir_path. Returns
+    # {'path', 'size', 'hash'} or None, where hash is only known (and
+    # otherwise None) for blobs, which are named by it, and size is None for
+    # snapshots that are directories.
+    def _snapshot(self, dir_path, file_name):
+        listing = self._listing(dir_path)
+        if listing is None:
+            return None
+        for candidate in [file_name] + [file_name + suffix for suffix in COMPRESSED_SUFFIXES]:
+            if candidate in listing['files'] or candidate in listing['subdirs']:
+                return {'path': os.path.join(dir_path, candidate), 'size': listing['files'].get(candidate),
+                        'hash': None}
+            if candidate in listing['pointers']:
+                blob_name = listing['pointers'][candidate]
+                resolved_path = blob_path(blob_name)
+                blob_listing = self._listing(os.path.dirname(resolved_path))
+                if blob_listing is not None and blob_name in blob_listing['files']:
+                    return {'path': resolved_path, 'size': blob_listing['files'][blob_name],
+                            'hash': blob_name.split('.')[0]}
+                logging.warning('Snapshot pointer %s names a missing blob %s: skipping.',
+                                os.path.join(dir_path, candidate + BLOB_POINTER_SUFFIX), resolved_path)
+        return None
+
+    # Returns the path to read for file_name in dir_path, or None.
+    def resolve(self, dir_path, file_name):
+        snapshot = self._snapshot(dir_path, file_name)
+        return None if snapshot is None else snapshot['path']
+
+    # Returns a list of {'path', 'date', 'size', 'hash'} for the dated
+    # subdirectories of directory_path that hold file_name, most recent first.
+    # If file_name is None, every dated subdirectory is listed with its own
+    # path.
+    def snapshots(self, directory_path, file_name):
+        listing = self._listing(directory_path)
+        if listing is None:
+            logging.warning('No subdirectories found for directory_path %s: skipping.', directory_path)
+            return []
+        result = []
+        for subdir_date, subdir_name in listing['dates']:
+            subdir_path = os.path.join(directory_path, subdir_name)
+            if file_name is None:
+                snapshot = {'path': subdir_path, 'size': None, 'hash': None}
+            else:
+                snapshot = self._snapshot(subdir_path, file_name)
+                if snapshot is None:
+                    continue
+            result.append({'path': snapshot['path'], 'date': subdir_date, 'size': snapshot['size'],
+                           'hash': snapshot['hash']})
+        return result
+
+    # Names of the source directories for a fetch method's path string (see
+    # fetch_method_to_path_string).
+    def source_names(self, fetch_string):
+        listing = self._listing(os.path.join(self.inputs_dir, fetch_string))
+        return [] if listing is None else sorted(listing['subdirs'])
+
+
+_snapshot_catalog = None
+
+# Returns the process-wide SnapshotCatalog, building it again if root_dir
+# moved.
+def get_snapshot_catalog():
+    global _snapshot_catalog  # pylint: disable=global-statement
+    inputs_dir = path_to('inputs_dir')
+    if _snapshot_catalog is None or _snapshot_catalog.inputs_dir != inputs_dir:
+        _snapshot_catalog = SnapshotCatalog(inputs_dir)
+    return _snapshot_catalog
 
 def most_recent_subdir(directory_path, file_name):
     sorted_subdir_list = all_subdirs_most_to_least_recent(directory_path, file_name)
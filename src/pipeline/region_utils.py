@@ -14,11 +14,114 @@
 
 # pylint: disable=unused-argument
 
+import os
+import numpy as np
 import pandas as pd
 
 import config
 import path_utils
 
+# Columns holding region codes. They all share one categorical dtype whose
+# categories are every code in locations.csv.
+REGION_CODE_COLUMNS = ['region_code',
+                       'parent_region_code',
+                       'level_1_region_code',
+                       'level_2_region_code',
+                       'level_3_region_code']
+
+
+class LocationIndex:
+    """In-memory view of locations.csv shared by all region code joins.
+
+    Sub-tables are split by region_code_type up front and restricted to the
+    region hierarchy columns plus whatever key a join needs, so joins don't
+    drag the whole wide locations table along. Region code columns are
+    categorical, using one dictionary built from the locations table, so
+    merges, duplicated() and groupby() on them work on integer codes.
+
+    If a population table exists, its population column is joined onto the
+    locations and also kept as an array aligned with the region code
+    categories, so a region code column can be turned into populations with a
+    single take on its codes.
+    """
+
+    def __init__(self, locations_path, population_path=None):
+        self.path = locations_path
+        self.mtime = os.path.getmtime(locations_path)
+        self.population_path = population_path
+        self.population_mtime = _mtime_or_none(population_path)
+        locations_df = pd.read_csv(locations_path)
+        all_codes = pd.concat([locations_df[c] for c in REGION_CODE_COLUMNS]).dropna().unique()
+        self.region_code_dtype = pd.CategoricalDtype(sorted(all_codes))
+        self.region_code_type_dtype = pd.CategoricalDtype(sorted(locations_df['region_code_type'].dropna().unique()))
+        self.locations_df = self.categorize(locations_df)
+        population = pd.Series(dtype='float64')
+        if self.population_mtime is not None:
+            population_df = pd.read_csv(population_path, usecols=['region_code', 'population'])
+            population = population_df.set_index('region_code')['population'].astype('float64')
+        self.locations_df['population'] = self.locations_df['region_code'].astype(object).map(population)
+        self.population_by_code = population.reindex(self.region_code_dtype.categories).to_numpy()
+        self.has_population = bool(population.notna().any())
+        self._by_type = dict(tuple(self.locations_df.groupby('region_code_type')))
+        self._leaf_to_region_code = {
+            region_code_type: dict(zip(type_df['leaf_region_code'], type_df['region_code']))
+            for region_code_type, type_df in self._by_type.items()}
+        iso1_df = self.of_type('iso_3166-1')
+        self.alpha_2_to_region_code = dict(zip(iso1_df['country_iso_3166-1_alpha-2'], iso1_df['region_code']))
+        self.iso_3166_2_region_codes = set(self.of_type('iso_3166-2')['region_code'].astype(str))
+
+    # Casts the region code columns present in df to the shared categorical dtypes.
+    def categorize(self, df):
+        for column in REGION_CODE_COLUMNS:
+            if column in df and df[column].dtype != self.region_code_dtype:
+                df[column] = df[column].astype(self.region_code_dtype)
+        if 'region_code_type' in df and df['region_code_type'].dtype != self.region_code_type_dtype:
+            df['region_code_type'] = df['region_code_type'].astype(self.region_code_type_dtype)
+        return df
+
+    def is_stale(self, locations_path, population_path=None):
+        return (locations_path != self.path or os.path.getmtime(locations_path) != self.mtime
+                or population_path != self.population_path or _mtime_or_none(population_path) != self.population_mtime)
+
+    def of_type(self, region_code_type):
+        if region_code_type not in self._by_type:
+            return self.locations_df.iloc[0:0]
+        return self._by_type[region_code_type]
+
+    def leaf_to_region_code(self, region_code_type):
+        return self._leaf_to_region_code.get(region_code_type, {})
+
+    def join_columns(self, keys, region_code_type=None):
+        locations_df = self.locations_df if region_code_type is None else self.of_type(region_code_type)
+        columns = config.all_region_columns() + [k for k in keys if k not in config.all_region_columns()]
+        return locations_df[columns]
+
+    def region_names(self):
+        return self.locations_df[['region_code', 'region_name']]
+
+    # Population of the region in each row of a region code column, NaN where unknown.
+    def populations(self, region_codes):
+        codes = region_codes.astype(self.region_code_dtype).cat.codes.to_numpy()
+        return np.where(codes >= 0, self.population_by_code[codes], np.nan)
+
+
+def _mtime_or_none(path):
+    if path is None or not os.path.exists(path):
+        return None
+    return os.path.getmtime(path)
+
+
+_location_index = None
+
+# Returns the process-wide LocationIndex, reloading it if locations.csv or the
+# population table moved or changed.
+def get_location_index():
+    global _location_index  # pylint: disable=global-statement
+    locations_path = path_utils.path_to('locations_csv')
+    population_path = path_utils.path_to('population_csv')
+    if _location_index is None or _location_index.is_stale(locations_path, population_path):
+        _location_index = LocationIndex(locations_path, population_path)
+    return _location_index
 
 def join_region_codes(data_df, params):
     reg_params = params['load']['regions']
@@ -26,22 +129,22 @@ def join_region_codes(data_df, params):
         data_df = join_single_region_code(data_df, reg_params['single_region_code'])
     else:
         data_df = join_on_keys(data_df, reg_params)
-    return data_df
+    return get_location_index().categorize(data_df)
 
 # This drops states (which have county = Unknown, state = state name, fips = NaN)
 # It also drops New York City (which has county = New York City, state = New York, fips = NaN)
 def join_nytimes_region_codes(data_df, params):
-    locations_df = pd.read_csv(path_utils.path_to('locations_csv'))
+    location_index = get_location_index()
     fips_data_df = data_df[data_df['fips'].notna()]
-    fips_locations = locations_df[locations_df['region_code_type'] == 'fips_6-4']
+    fips_locations = location_index.join_columns(['leaf_region_code'], 'fips_6-4')
     fips_data_df['padded_fips_code'] = fips_data_df['fips'].apply(lambda x: str(int(x)).zfill(5))
     fips_data_joined = fips_data_df.merge(fips_locations, left_on=['padded_fips_code'],
                                           right_on=['leaf_region_code'], how='left')
-    return fips_data_joined
+    return location_index.categorize(fips_data_joined)
 
 
 def join_mobility_region_codes(data_df, params):
-    locations_df = pd.read_csv(path_utils.path_to('locations_csv'))
+    location_index = get_location_index()
     iso1_data = data_df[
         data_df['country_region_code'].notna() &
         data_df['sub_region_1'].isna() &
@@ -54,29 +157,53 @@ def join_mobility_region_codes(data_df, params):
     fips_data = data_df[
         data_df['census_fips_code'].notna() &
         data_df['metro_area'].isna()]
-    iso1_locations = locations_df[locations_df['region_code_type'] == 'iso_3166-1']
+    iso1_locations = location_index.join_columns(['country_iso_3166-1_alpha-2'], 'iso_3166-1')
     iso1_joined = iso1_data.merge(iso1_locations, left_on=['country_region_code'],
                                   right_on=['country_iso_3166-1_alpha-2'], how='left')
-    iso2_locations = locations_df[locations_df['region_code_type'] == 'iso_3166-2']
+    iso2_locations = location_index.join_columns([], 'iso_3166-2')
     iso2_joined = iso2_data.merge(iso2_locations, left_on=['iso_3166_2_code'], right_on=['region_code'], how='left')
-    fips_locations = locations_df[locations_df['region_code_type'] == 'fips_6-4']
+    fips_locations = location_index.join_columns(['leaf_region_code'], 'fips_6-4')
     fips_data['padded_fips_code'] = fips_data['census_fips_code'].apply(lambda x: str(int(x)).zfill(5))
     fips_joined = fips_data.merge(fips_locations, left_on=['padded_fips_code'],
                                   right_on=['leaf_region_code'], how='left')
     joined_df = pd.concat([iso1_joined, iso2_joined, fips_joined])
     joined_df['census_fips_code'] = joined_df['padded_fips_code']
-    return joined_df
+    return location_index.categorize(joined_df)
+
+# Streaming counterpart of join_mobility_region_codes for frames read with
+# dtype=str, e.g. one chunk of a large Google export. Resolves region codes with
+# dict lookups on the location index instead of merges, and returns the
+# country, ISO 3166-2 and FIPS rows as three frames (in that order) holding
+# open_covid_region_code followed by the frame's own columns.
+def mobility_region_code_parts(data_df, iso_3166_2_column, fips_column):
+    location_index = get_location_index()
+    no_metro_area = data_df['metro_area'].isna() if 'metro_area' in data_df else pd.Series(True, index=data_df.index)
+    iso1_mask = (data_df['country_region_code'].notna() & data_df['sub_region_1'].isna()
+                 & data_df['sub_region_2'].isna() & no_metro_area)
+    iso2_mask = data_df[iso_3166_2_column].notna() & data_df[fips_column].isna() & no_metro_area
+    fips_mask = data_df[fips_column].notna() & no_metro_area
+    iso1_codes = data_df.loc[iso1_mask, 'country_region_code'].map(location_index.alpha_2_to_region_code)
+    iso2_codes = data_df.loc[iso2_mask, iso_3166_2_column]
+    iso2_codes = iso2_codes.where(iso2_codes.isin(location_index.iso_3166_2_region_codes))
+    padded_fips = pd.to_numeric(data_df.loc[fips_mask, fips_column]).astype('int64').astype(str).str.zfill(5)
+    fips_codes = padded_fips.map(location_index.leaf_to_region_code('fips_6-4'))
+    parts = []
+    for mask, codes in [(iso1_mask, iso1_codes), (iso2_mask, iso2_codes), (fips_mask, fips_codes)]:
+        part_df = data_df[mask].copy()
+        part_df[fips_column] = padded_fips if mask is fips_mask else np.nan
+        part_df.insert(0, 'open_covid_region_code', codes)
+        parts.append(part_df)
+    return parts
 
 def join_single_region_code(data_df, single_region_code):
     data_df['region_code'] = single_region_code
-    locations_df = pd.read_csv(path_utils.path_to('locations_csv'))
-    locations_df = locations_df[config.all_region_columns()]
+    locations_df = get_location_index().join_columns([])
     data_df = data_df.merge(locations_df, on=['region_code'])
     return data_df
 
 def join_on_keys(data_df, reg_params):
     mapping_keys = reg_params['mapping_keys']
-    locations_df = pd.read_csv(path_utils.path_to('locations_csv'))
+    locations_df = get_location_index().join_columns(list(mapping_keys.keys()))
     if 'level_1_region_code' in reg_params:
         locations_df = locations_df[locations_df['level_1_region_code'] == reg_params['level_1_region_code']]
     reversed_mapping_keys = {value: key for key, value in mapping_keys.items()}
@@ -90,8 +217,11 @@ def aggregate_and_append(data_df, params):
         agg_by = reg_params['aggregate_by']
         columns_to_sum = config.col_params_to_col_list(params['data'])
         agg_dict = {columns_to_sum[i]: 'sum' for i in range(len(columns_to_sum))}
-        agg_df = data_df.groupby(['date', agg_by]).agg(agg_dict).reset_index()
+        # Group on plain strings: categorical group keys would change the order of the appended rows.
+        group_keys = [data_df['date'], data_df[agg_by].astype(object)]
+        agg_df = data_df.groupby(group_keys).agg(agg_dict).reset_index()
         agg_df = agg_df.rename(columns={agg_by: 'region_code'})
+        agg_df = get_location_index().categorize(agg_df)
         data_df = data_df.append(agg_df, ignore_index=True)
         data_df = data_df.drop_duplicates(subset=['date', 'region_code'])
     return data_df
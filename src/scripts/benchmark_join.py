@@ -0,0 +1,65 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Times the single-pass join in join_data against the chain of pairwise outer
+# merges it replaced, on the CC-BY sources in data/inputs, and checks that both
+# produce the same frame.
+
+import sys
+import os
+import time
+
+PIPELINE_DIR = os.path.join(os.path.dirname(__file__), '../../', 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import args_utils
+import config
+import join_data
+import path_utils
+
+REPEATS = 5
+
+# Best time of REPEATS runs of join_func on frames, and the frame it returned.
+def best_time(join_func, frames):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        joined_df = join_func(frames)
+        times.append(time.perf_counter() - start)
+    return min(times), joined_df
+
+def main():
+    args = args_utils.get_parser().parse_args()
+    path_utils.root_dir = args.publish_dir
+
+    config_dict = config.read_config(
+        cc_by=True, cc_by_sa=False, cc_by_nc=False, google_tos=False, filter_not_approved=args.allowlist)
+    frames = list(join_data.get_time_series_data_by_type(config_dict, args.jobs).values())
+
+    merge_time, merged_df = best_time(join_data.merge_time_series_frames, frames)
+    align_time, aligned_df = best_time(join_data.align_time_series_frames, frames)
+
+    print(f'Joining {len(frames)} data types, {sum(len(df) for df in frames)} rows, best of {REPEATS}:')
+    print(f'  pairwise merges: {merge_time:.3f}s')
+    print(f'  single pass:     {align_time:.3f}s')
+    if join_data.can_align(frames):
+        same = merged_df.reset_index(drop=True).equals(aligned_df[merged_df.columns].reset_index(drop=True))
+        print('  results identical' if same else '  RESULTS DIFFER')
+    else:
+        print('  frames have duplicate or missing keys, the pipeline uses pairwise merges for them')
+
+
+if __name__ == '__main__':
+    main()
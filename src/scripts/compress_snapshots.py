@@ -0,0 +1,106 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compresses every csv input snapshot in place (daily.csv -> daily.csv.gz or
+# daily.csv.zst). Each compressed file is decompressed and compared with the
+# original before the original is removed. path_utils finds the compressed
+# files and pandas decompresses them while reading, so nothing else changes.
+# --compression zst needs the zstandard package.
+
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+
+PIPELINE_DIR = os.path.join(os.path.dirname(__file__), '../../', 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import args_utils
+import config
+import path_utils
+
+
+parser = argparse.ArgumentParser(parents=[args_utils.get_parser()], add_help=False)
+parser.add_argument('--compression', choices=['gz', 'zst'], default='gz',
+                    help='Compression format for the snapshots.')
+args = parser.parse_args()
+path_utils.root_dir = args.publish_dir
+
+sources = config.read_config(cc_by=True, cc_by_sa=True, google_tos=True, cc_by_nc=True,
+                             filter_by_fetch_method=None,
+                             filter_no_load_func=False,
+                             filter_no_data=False,
+                             filter_not_approved=args.allowlist)
+
+# Compressed files carry no timestamp or file name, so compressing the same
+# snapshot twice gives the same bytes.
+def write_compressed(infile, path):
+    with open(path, 'wb') as raw:
+        if args.compression == 'gz':
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as outfile:
+                shutil.copyfileobj(infile, outfile)
+        else:
+            import zstandard  # pylint: disable=import-outside-toplevel
+            with zstandard.ZstdCompressor(level=19).stream_writer(raw) as outfile:
+                shutil.copyfileobj(infile, outfile)
+
+def open_decompressed(path):
+    if args.compression == 'gz':
+        return gzip.open(path, 'rb')
+    import zstandard  # pylint: disable=import-outside-toplevel
+    return zstandard.open(path, 'rb')
+
+def stream_hash(f):
+    sha = hashlib.sha256()
+    for block in iter(lambda: f.read(1 << 20), b''):
+        sha.update(block)
+    return sha.hexdigest()
+
+# Writes path compressed next to it, checks that it decompresses to the same
+# bytes, then removes path. Returns the compressed size.
+def compress_snapshot(path):
+    compressed_path = f'{path}.{args.compression}'
+    tmp_path = compressed_path + '.tmp'
+    with open(path, 'rb') as infile:
+        write_compressed(infile, tmp_path)
+    with open(path, 'rb') as original, open_decompressed(tmp_path) as round_trip:
+        if stream_hash(original) != stream_hash(round_trip):
+            os.remove(tmp_path)
+            raise IOError(f'{tmp_path} does not decompress to {path}')
+    os.replace(tmp_path, compressed_path)
+    os.remove(path)
+    return os.path.getsize(compressed_path)
+
+num_snapshots = 0
+bytes_before = 0
+bytes_after = 0
+for k, params in sources.items():
+    if 'fetch' not in params or params['fetch']['method'] == 'STATIC':
+        continue
+    # Google sources are whole directory trees, not single files.
+    if 'load' in params and params['load']['function'] == 'google_load_function':
+        continue
+    for data_dict in path_utils.all_data_most_to_least_recent(params):
+        data_path = data_dict['path']
+        if (not data_path.endswith('.csv') or path_utils.is_blob_path(data_path)
+                or not os.path.isfile(data_path)):
+            continue
+        num_snapshots += 1
+        bytes_before += os.path.getsize(data_path)
+        bytes_after += compress_snapshot(data_path)
+
+print(f'Compressed {num_snapshots} snapshots from {bytes_before / 1e6:.1f} MB to {bytes_after / 1e6:.1f} MB.')
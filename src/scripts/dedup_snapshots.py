@@ -0,0 +1,90 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Moves every single-file input snapshot into the content-addressed blob store
+# and leaves a pointer file in its dated directory, so identical snapshots from
+# different days are stored once. path_utils resolves the pointers, so the rest
+# of the pipeline reads the blobs without knowing about them.
+
+import hashlib
+import os
+import shutil
+import sys
+
+PIPELINE_DIR = os.path.join(os.path.dirname(__file__), '../../', 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import args_utils
+import cache_utils
+import config
+import path_utils
+
+
+args = args_utils.get_parser().parse_args()
+path_utils.root_dir = args.publish_dir
+
+sources = config.read_config(cc_by=True, cc_by_sa=True, google_tos=True, cc_by_nc=True,
+                             filter_by_fetch_method=None,
+                             filter_no_load_func=False,
+                             filter_no_data=False,
+                             filter_not_approved=args.allowlist)
+
+def content_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+# Stores the snapshot at path as a blob, verifies the blob's content, then
+# replaces the snapshot with a pointer. Returns True if the blob was already
+# stored.
+def store_snapshot(path):
+    snapshot_hash = cache_utils.file_hash(path)
+    blob_name = snapshot_hash + os.path.splitext(path)[1]
+    stored_path = path_utils.blob_path(blob_name)
+    already_stored = os.path.exists(stored_path)
+    if not already_stored:
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        tmp_path = stored_path + '.tmp'
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, stored_path)
+    if content_hash(stored_path) != snapshot_hash:
+        raise IOError(f'Blob {stored_path} does not match snapshot {path}')
+    path_utils.write_blob_pointer(path, blob_name)
+    os.remove(path)
+    return already_stored
+
+num_snapshots = 0
+num_deduplicated = 0
+bytes_saved = 0
+for k, params in sources.items():
+    if 'fetch' not in params or params['fetch']['method'] == 'STATIC':
+        continue
+    # Google sources are whole directory trees, not single files.
+    if 'load' in params and params['load']['function'] == 'google_load_function':
+        continue
+    for data_dict in path_utils.all_data_most_to_least_recent(params):
+        data_path = data_dict['path']
+        if path_utils.is_blob_path(data_path) or not os.path.isfile(data_path):
+            continue
+        size = os.path.getsize(data_path)
+        num_snapshots += 1
+        if store_snapshot(data_path):
+            num_deduplicated += 1
+            bytes_saved += size
+
+print(f'Moved {num_snapshots} snapshots to {path_utils.path_to("blob_store_dir")}.')
+print(f'{num_deduplicated} were duplicates of a stored blob, saving {bytes_saved / 1e6:.1f} MB.')
@@ -12,10 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import logging
 import os
 import sys
-import wget  # pip3 install python3-wget, not pip install wget
 from datetime import datetime
 
 PIPELINE_DIR = os.path.join(os.path.dirname(__file__), '../../', 'src/pipeline')
@@ -23,6 +23,7 @@ PIPELINE_DIR = os.path.join(os.path.dirname(__file__), '../../', 'src/pipeline')
 sys.path.append(PIPELINE_DIR)
 
 import args_utils
+import fetch_utils
 import path_utils
 import config
 
@@ -35,6 +36,9 @@ if not args.allowlist:
 
 # Iterate through all the sources, and for anything that is an AUTOMATIC_DOWNLOAD
 # get the file from the source url and store it at the desired path.
+# Downloads run concurrently, and sources whose file hasn't changed upstream
+# since the last run (according to the stored ETag / Last-Modified validators)
+# are linked from their previous snapshot instead of downloaded again.
 
 automatic_downloads = config.read_config(cc_by=True, cc_by_sa=True, google_tos=True, cc_by_nc=True,
                                          filter_by_fetch_method='AUTOMATIC_DOWNLOAD',
@@ -42,19 +46,28 @@ automatic_downloads = config.read_config(cc_by=True, cc_by_sa=True, google_tos=T
                                          filter_no_data=False,
                                          filter_not_approved=args.allowlist)
 todays_date = datetime.today().strftime('%Y-%m-%d')
+validators = fetch_utils.read_validators()
 
+downloads = []
 for k in automatic_downloads:
     params = automatic_downloads[k]
-    source_url = params['fetch']['source_url']
     path_for_today = path_utils.path_to_data_for_date(params, todays_date)
-    print('Downloading data for: ', k)
-    print('Source url: ', source_url)
-    out_dir = path_for_today['dir']
-    out_file = path_for_today['file']
-    out_path = os.path.join(out_dir, out_file)
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    output = wget.download(source_url, out_path)
-    print('\nFile written to: ', output)
+    downloads.append({
+        'key': k,
+        'url': params['fetch']['source_url'],
+        'out_path': os.path.join(path_for_today['dir'], path_for_today['file']),
+        'validator': validators.get(k),
+    })
+
+results = asyncio.run(fetch_utils.fetch_all(downloads, max_concurrent=args.max_downloads))
+
+for download, result in zip(downloads, results):
+    print(f'{result["status"]}: {download["key"]} from {download["url"]}')
+    if result['status'] != 'failed':
+        print('    File written to: ', download['out_path'])
+        validators[download['key']] = result['validator']
+fetch_utils.write_validators(validators)
 
 print('Done with fetch_automatic_downloads.py')
+if any(result['status'] == 'failed' for result in results):
+    sys.exit(1)
@@ -12,8 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import logging
-import pandas as pd
 import os
 import sys
 
@@ -23,6 +23,7 @@ sys.path.append(PIPELINE_DIR)
 
 import args_utils
 import config
+import load_utils
 import path_utils
 
 args = args_utils.get_parser().parse_args()
@@ -49,17 +50,22 @@ spreadsheet_path = os.path.join(path_utils.path_to('spreadsheets_dir'), spreadsh
 print('Fetching spreadsheet for date: ', spreadsheet_date)
 print('Spreadsheet path: ', spreadsheet_path)
 
-# This assumes that every data source with params['fetch']['method'] == 'SCRAPED' comes from a single spreadsheet.
-# If that stops being the case, will need to update this.
-
-for k in scraped:
+# Writes the sheet for source k to its snapshot for spreadsheet_date, through a
+# temporary file that is moved into place.
+def write_source_csv(k, df):
     params = scraped[k]
     path_for_data = path_utils.path_to_data_for_date(params, spreadsheet_date)
-    df = pd.read_excel(spreadsheet_path, k)
     print('Fetched data will be written to: ', path_for_data)
     out_dir = path_for_data['dir']
     out_file = path_for_data['file']
     out_path = os.path.join(out_dir, out_file)
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    df.to_csv(out_path, index=False)
+    os.makedirs(out_dir, exist_ok=True)
+    df.to_csv(out_path + '.tmp', index=False)
+    os.replace(out_path + '.tmp', out_path)
+
+# This assumes that every data source with params['fetch']['method'] == 'SCRAPED' comes from a single spreadsheet.
+# If that stops being the case, will need to update this.
+# All sheets are read in one pass over the spreadsheet, then written in parallel.
+sheets = load_utils.read_workbook_sheets(spreadsheet_path, list(scraped))
+with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    list(executor.map(write_source_csv, sheets.keys(), sheets.values()))
@@ -0,0 +1,27 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import functools
+import multiprocessing
+
+import pytest
+
+
+# Starts every process pool with the spawn start method, the default on macOS
+# and Windows, whose workers share nothing with the parent but what is pickled.
+@pytest.fixture(name='spawn_pools')
+def spawn_pools_fixture(monkeypatch):
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', functools.partial(
+        concurrent.futures.ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn')))
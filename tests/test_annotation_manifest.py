@@ -0,0 +1,123 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import cache_utils
+import load_functions
+
+REPORT_FILES = ['FR.csv', 'IE.csv']
+
+
+def write_mobility_report(path, country_region_code):
+    pd.DataFrame({
+        'country_region_code': [country_region_code] * 2,
+        'sub_region_1': [None, None],
+        'sub_region_2': [None, None],
+        'iso_3166_2_code': [None, None],
+        'census_fips_code': [None, None],
+        'date': ['2020-12-01', '2020-12-02'],
+        'retail_and_recreation_percent_change_from_baseline': [-10, -12],
+    }).to_csv(path, index=False)
+
+# Annotates every report in input_dir into export_dir as a fresh process would.
+def annotate(input_dir, export_dir, jobs=1):
+    cache_utils._file_hashes.clear()  # pylint: disable=protected-access
+    load_functions.google_load_function(os.path.join(input_dir, REPORT_FILES[0]), {
+        'config_key': 'google_mobility_reports',
+        'export_path': export_dir,
+        'export_jobs': jobs,
+    })
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+# Input and export directories, with a mobility report for each of REPORT_FILES
+# in the input directory.
+@pytest.fixture(name='dirs')
+def dirs_fixture(tmp_path):
+    input_dir = tmp_path / 'inputs'
+    export_dir = tmp_path / 'exports'
+    input_dir.mkdir()
+    export_dir.mkdir()
+    for report_file in REPORT_FILES:
+        write_mobility_report(input_dir / report_file, report_file.split('.')[0])
+    return str(input_dir), str(export_dir)
+
+# Names of the files annotated since the test started.
+@pytest.fixture(name='annotated_files')
+def annotated_files_fixture(monkeypatch):
+    annotated_files = []
+    annotate_google_file = load_functions._annotate_google_file  # pylint: disable=protected-access
+    monkeypatch.setattr(load_functions, '_annotate_google_file',
+                        lambda input_path, output_path: annotated_files.append(os.path.basename(input_path))
+                        or annotate_google_file(input_path, output_path))
+    return annotated_files
+
+
+def test_unchanged_annotations_are_skipped_without_rewriting_the_manifest(dirs, annotated_files):
+    input_dir, export_dir = dirs
+    annotate(input_dir, export_dir)
+    assert sorted(annotated_files) == REPORT_FILES
+    assert pd.read_csv(os.path.join(export_dir, 'IE.csv'))['open_covid_region_code'].tolist() == ['IRL', 'IRL']
+    manifest_mtime = os.path.getmtime(cache_utils.annotation_manifest_path(export_dir))
+    annotated_files.clear()
+    annotate(input_dir, export_dir)
+    assert annotated_files == []
+    assert os.path.getmtime(cache_utils.annotation_manifest_path(export_dir)) == manifest_mtime
+
+def test_fresh_checkout_skips_unchanged_annotations(dirs, annotated_files):
+    input_dir, export_dir = dirs
+    annotate(input_dir, export_dir)
+    manifest_mtime = os.path.getmtime(cache_utils.annotation_manifest_path(export_dir))
+    # A checkout gives every file the time it was written out.
+    for report_file in REPORT_FILES:
+        for path in [os.path.join(input_dir, report_file), os.path.join(export_dir, report_file)]:
+            os.utime(path, (manifest_mtime + 100, manifest_mtime + 100))
+    annotated_files.clear()
+    annotate(input_dir, export_dir)
+    assert annotated_files == []
+    assert os.path.getmtime(cache_utils.annotation_manifest_path(export_dir)) == manifest_mtime
+
+def test_edited_annotation_is_rebuilt(dirs, annotated_files):
+    input_dir, export_dir = dirs
+    annotate(input_dir, export_dir)
+    output_path = os.path.join(export_dir, 'IE.csv')
+    expected = read_file(output_path)
+    with open(output_path, 'w') as f:
+        f.write(expected.replace('IE,', 'XX,'))
+    annotated_files.clear()
+    annotate(input_dir, export_dir)
+    assert annotated_files == ['IE.csv']
+    assert read_file(output_path) == expected
+
+@pytest.mark.usefixtures('spawn_pools')
+def test_annotation_in_spawned_workers(dirs, tmp_path):
+    input_dir, export_dir = dirs
+    annotate(input_dir, export_dir, jobs=2)
+    serial_export_dir = str(tmp_path / 'serial_exports')
+    os.mkdir(serial_export_dir)
+    annotate(input_dir, serial_export_dir)
+    for report_file in REPORT_FILES + [cache_utils.ANNOTATION_MANIFEST]:
+        assert read_file(os.path.join(export_dir, report_file)) == read_file(
+            os.path.join(serial_export_dir, report_file))
@@ -0,0 +1,71 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+import pytest
+from tornado import httpclient, httpserver, testing, web
+
+APP_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/app')
+
+sys.path.append(APP_DIR)
+
+import app
+
+DATA_CSV = 'region_code,date,hospitalized_current\nIRL,2020-12-14,10\nFRA,2020-12-14,20\n'
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('', False),
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('deflate, GZIP;q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.0, identity', False),
+    ('*', True),
+    ('*;q=0', False),
+    ('gzip;q=0, *', False),
+    ('identity', False),
+    ('x-gzip-but-not-really', False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert app.accepts_gzip(accept_encoding) == expected
+
+# Fetches /data.json from a local server with the given request headers.
+async def fetch(headers):
+    sock, port = testing.bind_unused_port()
+    server = httpserver.HTTPServer(web.Application([('/data.json', app.DataHandler)]))
+    server.add_sockets([sock])
+    try:
+        return await httpclient.AsyncHTTPClient().fetch(
+            f'http://127.0.0.1:{port}/data.json', headers=headers, decompress_response=False, raise_error=False)
+    finally:
+        server.stop()
+
+def test_gzip_refused_with_q_zero(monkeypatch):
+    for name in ['CACHED_RESPONSE', 'CACHED_CSV_HASH', 'LAST_UPDATED']:
+        monkeypatch.setattr(app, name, None)
+    app.format_data(DATA_CSV)
+    identity = asyncio.run(fetch({'Accept-Encoding': 'gzip;q=0'}))
+    assert identity.code == 200
+    assert 'Content-Encoding' not in identity.headers
+    assert identity.headers['Etag'] == app.CACHED_RESPONSE.etag
+    assert [r['region_code'] for r in json.loads(identity.body)['data']] == ['IRL', 'FRA']
+    gzipped = asyncio.run(fetch({'Accept-Encoding': 'gzip, deflate'}))
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.body) == identity.body
@@ -0,0 +1,35 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import args_utils
+
+
+@pytest.mark.parametrize('flag', ['--jobs', '--max_downloads'])
+@pytest.mark.parametrize('value', ['0', '-1', 'two'])
+def test_counts_below_one_are_rejected(flag, value):
+    with pytest.raises(SystemExit):
+        args_utils.get_parser().parse_args([flag, value])
+
+def test_max_downloads():
+    assert args_utils.get_parser().parse_args([]).max_downloads == 8
+    assert args_utils.get_parser().parse_args(['--max_downloads', '1']).max_downloads == 1
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pytest
 import yamale
 import os
 import sys
@@ -30,3 +31,39 @@ def test_config_file_schema():
          print(source_file)
          data = yamale.make_data(os.path.join(path_utils.path_to('sources_dir'), source_file))
          yamale.validate(schema, data, strict=True)
+
+def validate_transforms(transforms_yaml):
+    schema = yamale.make_schema(path_utils.path_to('schema_yaml'))
+    content = f'''
+load:
+  function: 'default_load_function'
+  aggregate_data: True
+  dates:
+    parse_function: 'default'
+  transforms:
+{transforms_yaml}
+license:
+  cc_by: True
+  cc_by_sa: False
+  cc_by_nc: False
+  google_tos: False
+attribution:
+  title: 'Test'
+  source_name: 'Test'
+  data_link: 'https://example.com'
+'''
+    yamale.validate(schema, yamale.make_data(content=content), strict=True)
+
+def test_transform_rules_are_validated():
+    validate_transforms("    - {to_column: 'a', sum_columns: ['b', 'c']}")
+    validate_transforms("    - {to_column: 'a', from_column: 'b', region_column: 'r', regions_before_date: {X: '2020-04-11'}}")
+    invalid_rules = [
+        "    - {to_column: 'a'}",
+        "    - {to_column: 'a', sum_columns: ['b'], from_column: 'c', region_column: 'r', "
+        "regions_before_date: {X: '2020-04-11'}}",
+        "    - {to_column: 'a', from_column: 'b'}",
+        "    - {to_column: 'a', from_column: 'b', region_column: 'r'}",
+    ]
+    for rule in invalid_rules:
+        with pytest.raises(yamale.YamaleError):
+            validate_transforms(rule)
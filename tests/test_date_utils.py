@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import date_utils
+import path_utils
+
+
+@pytest.fixture(name='root_dir')
+def root_dir_fixture(tmp_path, monkeypatch):
+    monkeypatch.setattr(path_utils, 'root_dir', str(tmp_path))
+    monkeypatch.setattr(date_utils, '_date_formats', {})
+    return tmp_path
+
+def forget_date_formats():
+    date_utils._date_formats.clear()  # pylint: disable=protected-access
+
+def infer_in_worker(root_dir, config_key, values):
+    path_utils.root_dir = root_dir
+    return date_utils.infer_date_format(pd.Series(values), config_key)
+
+
+def test_to_dates_tries_formats_in_order():
+    values = pd.Series(['2020-03-01', '15/03/2020', None, '2020-03-01'], index=[5, 6, 7, 8])
+    dates = date_utils.to_dates(values, ['%Y-%m-%d', '%d/%m/%Y'])
+    assert list(dates.index) == [5, 6, 7, 8]
+    assert list(dates[:2]) == [pd.Timestamp('2020-03-01'), pd.Timestamp('2020-03-15')]
+    assert pd.isna(dates[7])
+    assert dates[8] == dates[5]
+
+def test_to_dates_rejects_unmatched_values():
+    with pytest.raises(ValueError, match='2020/13/45'):
+        date_utils.to_dates(pd.Series(['2020-03-01', '2020/13/45']), ['%Y-%m-%d'])
+
+def test_to_dates_normalizes_times_and_time_zones():
+    values = pd.Series(pd.to_datetime(['2020-03-01 10:30', '2020-03-02 23:00']).tz_localize('UTC'))
+    dates = date_utils.to_dates(values, None)
+    assert dates.dtype == np.dtype('datetime64[ns]')
+    assert list(dates) == [pd.Timestamp('2020-03-01'), pd.Timestamp('2020-03-02')]
+
+def test_infer_date_format_finds_and_remembers_format(root_dir):  # pylint: disable=unused-argument
+    assert date_utils.infer_date_format(pd.Series(['13/03/2020', '01/04/2020']), 'source') == '%d/%m/%Y'
+    assert os.path.exists(date_utils.date_format_path('source'))
+    forget_date_formats()
+    # Ambiguous dates keep the remembered day-first format rather than the
+    # month-first format that comes earlier in the list.
+    assert date_utils.infer_date_format(pd.Series(['01/04/2020']), 'source') == '%d/%m/%Y'
+    forget_date_formats()
+    assert date_utils.infer_date_format(pd.Series(['01/04/2020']), 'other_source') == '%m/%d/%Y'
+
+def test_infer_date_format_without_a_fitting_format(root_dir):  # pylint: disable=unused-argument
+    assert date_utils.infer_date_format(pd.Series(['2020-03-01', '15/03/2020']), 'source') is None
+    assert not os.path.exists(date_utils.date_format_path('source'))
+
+def test_worker_processes_keep_each_others_formats(root_dir):
+    sources = {f'source_{i}': ['13/03/2020'] if i % 2 else ['2020-03-13'] for i in range(8)}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(infer_in_worker, [str(root_dir)] * len(sources), sources.keys(), sources.values()))
+    for config_key, values in sources.items():
+        assert date_utils.read_date_format(config_key) == ('%d/%m/%Y' if values[0][2] == '/' else '%Y-%m-%d')
@@ -0,0 +1,121 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import cache_utils
+import export_utils
+import load_data
+import path_utils
+
+
+def source_params(config_key, data_type):
+    return {
+        'config_key': config_key,
+        'fetch': {'method': 'SCRAPED', 'file': f'{config_key}.csv'},
+        'load': {
+            'aggregate_data': True,
+            'function': 'default_load_function',
+            'dates': {'columns': ['date'], 'parse_function': 'default'},
+            'regions': {'single_region_code': 'IRL'},
+        },
+        'data': {data_type: {'cumulative': f'{data_type}_cumulative'}},
+    }
+
+def write_snapshot(params, date, values):
+    data_type = list(params['data'])[0]
+    path_to_data = path_utils.path_to_data_for_date(params, date)
+    os.makedirs(path_to_data['dir'], exist_ok=True)
+    pd.DataFrame({
+        'date': [f'2020-12-{day:02d}' for day in range(1, len(values) + 1)],
+        f'{data_type}_cumulative': values,
+    }).to_csv(os.path.join(path_to_data['dir'], path_to_data['file']), index=False)
+
+@pytest.fixture(name='export')
+def export_fixture(tmp_path, monkeypatch):
+    locations_csv = path_utils.path_to('locations_csv')
+    monkeypatch.setattr(path_utils, 'root_dir', str(tmp_path))
+    monkeypatch.setitem(path_utils._resources, 'locations_csv', locations_csv)  # pylint: disable=protected-access
+    code_file = tmp_path / 'export_code.py'
+    code_file.write_text('# version 1\n')
+    monkeypatch.setattr(cache_utils, 'EXPORT_CODE_FILES', cache_utils.EXPORT_CODE_FILES + [str(code_file)])
+    loaded_types = []
+    load_data_types = load_data.load_data_types
+    monkeypatch.setattr(load_data, 'load_data_types',
+                        lambda data_types, *args: loaded_types.append(list(data_types))
+                        or load_data_types(data_types, *args))
+    config_dict = {
+        'hospitalized_source': source_params('hospitalized_source', 'hospitalized'),
+        'icu_source': source_params('icu_source', 'icu'),
+    }
+    write_snapshot(config_dict['hospitalized_source'], '2020-12-14', [1, 2, 3])
+    write_snapshot(config_dict['icu_source'], '2020-12-14', [4, 5, 6])
+    export_path = str(tmp_path / 'aggregated.csv')
+
+    # Runs one export as a fresh process would, returning the data types it
+    # loaded, or None if it skipped loading entirely.
+    def run():
+        load_data.clear_source_cache()
+        loaded_types.clear()
+        export_utils.export_aggregated_data(config_dict, export_path)
+        return loaded_types[0] if loaded_types else None
+
+    run.config_dict = config_dict
+    run.export_path = export_path
+    run.code_file = code_file
+    return run
+
+
+def test_first_export_builds_every_data_type(export):
+    assert export() == ['cases', 'deaths', 'testing', 'hospitalized', 'discharged', 'icu', 'ventilator',
+                        'policy', 'mobility']
+    df = pd.read_csv(export.export_path)
+    assert list(df['hospitalized_cumulative']) == [1, 2, 3]
+    assert list(df['icu_cumulative']) == [4, 5, 6]
+
+def test_unchanged_export_is_skipped(export):
+    export()
+    mtime = os.path.getmtime(export.export_path)
+    assert export() is None
+    assert os.path.getmtime(export.export_path) == mtime
+
+def test_only_changed_data_types_are_rebuilt(export):
+    export()
+    write_snapshot(export.config_dict['icu_source'], '2020-12-15', [4, 5, 6, 7])
+    assert export() == ['icu']
+    df = pd.read_csv(export.export_path)
+    assert list(df['hospitalized_cumulative'].fillna(-1)) == [1, 2, 3, -1]
+    assert list(df['icu_cumulative']) == [4, 5, 6, 7]
+
+def test_missing_output_is_rebuilt_from_cached_frames(export):
+    export()
+    with open(export.export_path) as f:
+        expected = f.read()
+    os.remove(export.export_path)
+    assert export() == []
+    with open(export.export_path) as f:
+        assert f.read() == expected
+
+def test_export_code_change_rebuilds_every_data_type(export):
+    first_types = export()
+    export.code_file.write_text('# version 2, a different size\n')
+    assert export() == first_types
@@ -0,0 +1,243 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import gzip
+import hashlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import fetch_utils
+import path_utils
+
+LAST_MODIFIED = 'Mon, 14 Dec 2020 00:00:00 GMT'
+
+
+class StandInServer:
+    """Local stand-in for the upstream servers.
+
+    Serves the bodies in files with a content ETag (except under /no_etag/,
+    which only sends Last-Modified), answers conditional GETs with 304 and
+    records every request and client connection.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.client_ports = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler bound to this stand-in."""
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                with stand_in.lock:
+                    stand_in.requests.append((self.path, dict(self.headers)))
+                    stand_in.client_ports.add(self.client_address[1])
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.in_flight -= 1
+                if self.path.startswith('/redirect/'):
+                    self.send_response(302)
+                    self.send_header('Location', self.path[len('/redirect'):])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path not in stand_in.files:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = stand_in.files[self.path]
+                etag = None if self.path.startswith('/no_etag/') else f'"{hashlib.sha256(body).hexdigest()}"'
+                not_modified = (self.headers.get('If-None-Match') == etag if etag is not None
+                                else self.headers.get('If-Modified-Since') == LAST_MODIFIED)
+                self.send_response(304 if not_modified else 200)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Last-Modified', LAST_MODIFIED)
+                self.send_header('Content-Length', '0' if not_modified else str(len(body)))
+                self.end_headers()
+                if not not_modified:
+                    self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def conditional_requests(self):
+        return [path for path, headers in self.requests
+                if 'If-None-Match' in headers or 'If-Modified-Since' in headers]
+
+
+@pytest.fixture(name='server')
+def server_fixture():
+    stand_in = StandInServer()
+    stand_in.thread.start()
+    yield stand_in
+    stand_in.httpd.shutdown()
+    stand_in.httpd.server_close()
+
+@pytest.fixture(name='root_dir')
+def root_dir_fixture(tmp_path, monkeypatch):
+    monkeypatch.setattr(path_utils, 'root_dir', str(tmp_path))
+    return tmp_path
+
+def make_downloads(server, paths, root_dir, date, validators=None):
+    validators = validators or {}
+    return [{
+        'key': f'source_{i}',
+        'url': server.url(path),
+        'out_path': os.path.join(str(root_dir), f'source_{i}', date, 'data.csv'),
+        'validator': validators.get(f'source_{i}'),
+    } for i, path in enumerate(paths)]
+
+def fetch(downloads, max_concurrent=8):
+    results = asyncio.run(fetch_utils.fetch_all(downloads, max_concurrent=max_concurrent))
+    return results, {r['key']: r['validator'] for r in results if r['status'] != 'failed'}
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_downloads_every_file(server, root_dir):
+    paths = [f'/file_{i}.csv' for i in range(20)]
+    for i, path in enumerate(paths):
+        server.files[path] = f'date,value\n2020-12-14,{i}\n'.encode('utf-8')
+    downloads = make_downloads(server, paths, root_dir, '2020-12-14')
+    results, _ = fetch(downloads)
+    assert [r['status'] for r in results] == ['downloaded'] * len(paths)
+    for download, path in zip(downloads, paths):
+        assert read(download['out_path']) == server.files[path]
+
+def test_concurrency_is_bounded_and_connections_reused(server, root_dir):
+    server.delay = 0.05
+    paths = [f'/file_{i}.csv' for i in range(24)]
+    for path in paths:
+        server.files[path] = b'date,value\n'
+    fetch(make_downloads(server, paths, root_dir, '2020-12-14'), max_concurrent=4)
+    assert 1 < server.max_in_flight <= 4
+    assert len(server.client_ports) <= 4
+
+def test_unchanged_file_is_not_downloaded_again(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n2020-12-14,1\n'
+    _, validators = fetch(make_downloads(server, ['/data.csv'], root_dir, '2020-12-14'))
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators)
+    results, new_validators = fetch(downloads)
+    assert results[0]['status'] == 'not_modified'
+    assert server.conditional_requests() == ['/data.csv']
+    assert read(downloads[0]['out_path']) == server.files['/data.csv']
+    assert new_validators['source_0']['path'] == os.path.join('source_0', '2020-12-15', 'data.csv')
+    assert new_validators['source_0']['etag'] == validators['source_0']['etag']
+
+def test_changed_file_is_downloaded(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n2020-12-14,1\n'
+    _, validators = fetch(make_downloads(server, ['/data.csv'], root_dir, '2020-12-14'))
+    server.files['/data.csv'] = b'date,value\n2020-12-14,1\n2020-12-15,2\n'
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators)
+    results, new_validators = fetch(downloads)
+    assert results[0]['status'] == 'downloaded'
+    assert read(downloads[0]['out_path']) == server.files['/data.csv']
+    assert new_validators['source_0']['etag'] != validators['source_0']['etag']
+
+def test_unchanged_blob_gets_a_pointer(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n2020-12-14,1\n'
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-14')
+    _, validators = fetch(downloads)
+    blob_name = hashlib.sha256(server.files['/data.csv']).hexdigest() + '.csv'
+    os.makedirs(os.path.dirname(path_utils.blob_path(blob_name)))
+    os.replace(downloads[0]['out_path'], path_utils.blob_path(blob_name))
+    path_utils.write_blob_pointer(downloads[0]['out_path'], blob_name)
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators)
+    results, _ = fetch(downloads)
+    assert results[0]['status'] == 'not_modified'
+    assert not os.path.exists(downloads[0]['out_path'])
+    assert path_utils.resolve_snapshot_file(downloads[0]['out_path']) == path_utils.blob_path(blob_name)
+
+def test_unchanged_compressed_file_is_linked_compressed(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n2020-12-14,1\n'
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-14')
+    _, validators = fetch(downloads)
+    with open(downloads[0]['out_path'], 'rb') as infile, gzip.open(downloads[0]['out_path'] + '.gz', 'wb') as outfile:
+        outfile.write(infile.read())
+    os.remove(downloads[0]['out_path'])
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators)
+    results, _ = fetch(downloads)
+    assert results[0]['status'] == 'not_modified'
+    assert path_utils.resolve_snapshot_file(downloads[0]['out_path']) == downloads[0]['out_path'] + '.gz'
+    with gzip.open(downloads[0]['out_path'] + '.gz', 'rb') as f:
+        assert f.read() == server.files['/data.csv']
+
+def test_last_modified_validator(server, root_dir):
+    server.files['/no_etag/data.csv'] = b'date,value\n'
+    _, validators = fetch(make_downloads(server, ['/no_etag/data.csv'], root_dir, '2020-12-14'))
+    assert validators['source_0']['etag'] is None
+    assert validators['source_0']['last_modified'] == LAST_MODIFIED
+    results, _ = fetch(make_downloads(server, ['/no_etag/data.csv'], root_dir, '2020-12-15', validators))
+    assert results[0]['status'] == 'not_modified'
+
+def test_validator_without_previous_file_is_not_sent(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n'
+    _, validators = fetch(make_downloads(server, ['/data.csv'], root_dir, '2020-12-14'))
+    os.remove(os.path.join(str(root_dir), validators['source_0']['path']))
+    results, _ = fetch(make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators))
+    assert results[0]['status'] == 'downloaded'
+    assert server.conditional_requests() == []
+
+def test_redirects_are_followed(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n'
+    downloads = make_downloads(server, ['/redirect/data.csv'], root_dir, '2020-12-14')
+    results, _ = fetch(downloads)
+    assert results[0]['status'] == 'downloaded'
+    assert read(downloads[0]['out_path']) == server.files['/data.csv']
+
+def test_failed_download_keeps_old_validator(server, root_dir):
+    server.files['/data.csv'] = b'date,value\n'
+    _, validators = fetch(make_downloads(server, ['/data.csv'], root_dir, '2020-12-14'))
+    del server.files['/data.csv']
+    downloads = make_downloads(server, ['/data.csv'], root_dir, '2020-12-15', validators)
+    results, _ = fetch(downloads)
+    assert results[0]['status'] == 'failed'
+    assert results[0]['validator'] == validators['source_0']
+    assert not os.path.exists(downloads[0]['out_path'])
+
+def test_validators_round_trip(root_dir):  # pylint: disable=unused-argument
+    assert fetch_utils.read_validators() == {}
+    validators = {'source_0': {'url': 'http://example.com/data.csv', 'path': 'source_0/2020-12-14/data.csv',
+                               'etag': '"abc"', 'last_modified': LAST_MODIFIED}}
+    fetch_utils.write_validators(validators)
+    assert fetch_utils.read_validators() == validators
@@ -0,0 +1,71 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import cache_utils
+import config
+import load_data
+import path_utils
+
+# The newest moldova_hospitalizations snapshot has a date in 2920 and fails
+# to load.
+SOURCES = ['czech_republic_hospitalizations', 'denmark_hospitalizations', 'moldova_hospitalizations']
+
+
+# Params of SOURCES, with the newest snapshot of each copied into a fresh tree
+# under tmp_path that path_utils points at.
+@pytest.fixture(name='params_list')
+def params_list_fixture(tmp_path, monkeypatch):
+    sources = config.read_config(cc_by=True, cc_by_sa=True, cc_by_nc=True, google_tos=True)
+    params_list = [sources[source] for source in SOURCES]
+    snapshot_paths = [path_utils.all_data_most_to_least_recent(params)[0] for params in params_list]
+    locations_csv = path_utils.path_to('locations_csv')
+    monkeypatch.setattr(path_utils, 'root_dir', str(tmp_path))
+    os.makedirs(os.path.dirname(path_utils.path_to('locations_csv')))
+    os.symlink(locations_csv, path_utils.path_to('locations_csv'))
+    for params, snapshot in zip(params_list, snapshot_paths):
+        path_to_data = path_utils.path_to_data_for_date(params, snapshot['date'].isoformat())
+        os.makedirs(path_to_data['dir'])
+        shutil.copyfile(snapshot['path'], os.path.join(path_to_data['dir'], path_to_data['file']))
+    yield params_list
+    load_data.clear_source_cache()
+    for params in params_list:
+        cache_utils.forget_load_statuses(params)
+
+
+@pytest.mark.usefixtures('spawn_pools')
+def test_load_sources_in_spawned_workers(params_list):
+    pooled_dfs = load_data.load_sources(params_list, jobs=2)
+    # Statuses recorded by the workers are seen by this process.
+    assert [[status['status'] for status in cache_utils.read_load_statuses(params).values()]
+            for params in params_list] == [['ok'], ['ok'], ['failed']]
+    load_data.clear_source_cache()
+    shutil.rmtree(path_utils.path_to('cache_dir'))
+    for params in params_list:
+        cache_utils.forget_load_statuses(params)
+    serial_dfs = load_data.load_sources(params_list, jobs=1)
+    assert pooled_dfs[2] is None and serial_dfs[2] is None
+    for pooled_df, serial_df in zip(pooled_dfs[:2], serial_dfs[:2]):
+        assert len(pooled_df) > 0
+        pd.testing.assert_frame_equal(pooled_df, serial_df)
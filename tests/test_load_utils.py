@@ -0,0 +1,78 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+
+sys.path.append(PIPELINE_DIR)
+
+import load_utils
+
+
+# Two regions, four days each. Region MD reported current rather than
+# cumulative hospitalizations until 2020-04-03.
+def spain_frame():
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2020-04-01', '2020-04-02', '2020-04-03', '2020-04-04'] * 2),
+        'region_code': ['ES-MD'] * 4 + ['ES-CL'] * 4,
+        'local_alpha_code': ['MD'] * 4 + ['CL'] * 4,
+        'hospitalized_cumulative': [50.0, 40.0, 100.0, 110.0, 1.0, 3.0, 6.0, 10.0],
+    })
+
+def spain_params():
+    return {
+        'load': {
+            'transforms': [{
+                'from_column': 'hospitalized_cumulative',
+                'to_column': 'hospitalized_current',
+                'region_column': 'local_alpha_code',
+                'regions_before_date': {'MD': '2020-04-03'},
+            }],
+        },
+        'data': {'hospitalized': {'cumulative': 'hospitalized_cumulative'}},
+    }
+
+
+def test_from_column_moves_values_before_the_cutoff():
+    df = load_utils.apply_transforms(spain_frame(), spain_params())
+    np.testing.assert_array_equal(df['hospitalized_current'], [50, 40] + [np.nan] * 6)
+    np.testing.assert_array_equal(df['hospitalized_cumulative'], [np.nan, np.nan, 100, 110, 1, 3, 6, 10])
+
+def test_new_is_derived_from_cumulative_after_transforms():
+    params = spain_params()
+    df = load_utils.apply_transforms(spain_frame(), params)
+    df = load_utils.derive_data_columns(df, params)
+    # Moved rows have no cumulative value, so there is no change to derive on
+    # them or on the first day after the cutoff.
+    np.testing.assert_array_equal(df['hospitalized_new'], [np.nan, np.nan, np.nan, 10, np.nan, 2, 3, 4])
+
+def test_new_is_empty_when_the_previous_day_is_missing():
+    df = spain_frame().drop(index=[2, 5]).sample(frac=1, random_state=0)
+    df = load_utils.derive_data_columns(df, {'data': {'hospitalized': {'cumulative': 'hospitalized_cumulative'}}})
+    df = df.sort_values(['region_code', 'date'])
+    np.testing.assert_array_equal(df['hospitalized_new'], [np.nan, np.nan, 4, np.nan, -10, np.nan])
+
+def test_cumulative_is_derived_from_new():
+    df = pd.DataFrame({
+        'date': pd.to_datetime(['2020-04-02', '2020-04-01', '2020-04-01', '2020-04-03']),
+        'region_code': ['ES-MD', 'ES-MD', 'ES-CL', 'ES-MD'],
+        'hospitalized_new': [2.0, 1.0, 5.0, 3.0],
+    })
+    df = load_utils.derive_data_columns(df, {'data': {'hospitalized': {'new': 'hospitalized_new'}}})
+    np.testing.assert_array_equal(df['hospitalized_cumulative'], [3, 1, 5, 6])
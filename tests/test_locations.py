@@ -13,13 +13,16 @@
 # limitations under the License.
 
 import os
+import numpy as np
 import pandas as pd
+import pytest
 import sys
 
 PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
 
 sys.path.append(PIPELINE_DIR)
 
+import join_data
 import path_utils
 
 LOCATIONS_INTERMEDIATE_FILES = ['fips_locations.csv', 'iso_3166_1_locations.csv', 'iso_3166_2_locations.csv', 'other_locations.csv']
@@ -38,3 +41,35 @@ def test_intermediate_locations_unique():
         location_duplicates = locations_df[locations_df['region_code'].duplicated(keep=False)]
         print(location_duplicates)
         assert location_duplicates.shape[0] == 0
+
+def test_population_region_codes():
+    population_path = path_utils.path_to('population_csv')
+    if not os.path.exists(population_path):
+        pytest.skip('no population table in data/inputs/static/locations')
+    population_df = pd.read_csv(population_path)
+    locations_df = pd.read_csv(path_utils.path_to('locations_csv'))
+    duplicates = population_df[population_df['region_code'].duplicated(keep=False)]
+    print(duplicates)
+    assert duplicates.shape[0] == 0
+    unknown_region_codes = population_df[~population_df['region_code'].isin(locations_df['region_code'])]
+    print(unknown_region_codes)
+    assert unknown_region_codes.shape[0] == 0
+    assert (population_df['population'] > 0).all()
+
+def test_per_capita_columns(tmp_path, monkeypatch):
+    population_path = tmp_path / 'population.csv'
+    pd.DataFrame({'region_code': ['IE', 'US-CA'], 'population': [5000000, 40000000]}).to_csv(
+        population_path, index=False)
+    monkeypatch.setitem(path_utils._resources, 'population_csv', str(population_path))  # pylint: disable=protected-access
+    time_series_df = pd.DataFrame({
+        'region_code': ['IE', 'IE', 'US-CA', 'NO-SUCH-REGION'],
+        'date': pd.to_datetime(['2020-12-01', '2020-12-02', '2020-12-01', '2020-12-01']),
+        'cases_new': [50, 100, 400, 10],
+        'cases_new_per_million': [np.nan, 7.5, np.nan, np.nan],
+        'tests_cumulative': [1000, 2000, 8000, 10],
+    })
+    df = join_data.add_per_capita_columns(time_series_df)
+    # The source-provided 7.5 is kept; the region without a population stays empty.
+    np.testing.assert_array_equal(df['cases_new_per_million'], [10, 7.5, 10, np.nan])
+    np.testing.assert_array_equal(df['tests_cumulative_per_thousand'], [0.2, 0.4, 0.2, np.nan])
+    assert 'cases_cumulative_per_million' not in df
@@ -12,9 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import os
 import datetime
-import pandas as pd
 import sys
 
 PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
@@ -22,9 +22,16 @@ PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file_
 sys.path.append(PIPELINE_DIR)
 
 import config
+import load_utils
 import path_utils
 
 
+# First rows of every sheet in the spreadsheet at hosp_file, read in one pass
+# and shared by the tests below.
+@functools.lru_cache(maxsize=None)
+def read_sheet_heads(hosp_file):
+    return load_utils.read_workbook_sheets(hosp_file, nrows=2)
+
 # All subdirectories within spreadsheets_dir should be named as '%Y-%m-%d' dates.
 def test_spreadsheet_dates():
     _, subdirs, _ = next(os.walk(path_utils.path_to('spreadsheets_dir')))
@@ -57,8 +64,7 @@ def test_spreadsheet_tabs_against_allowlist():
     for subdir in subdirs:
         subdir_path = os.path.join(dirpath, subdir)
         hosp_file = os.path.join(subdir_path, 'hospitalizations.xlsx')
-        xl = pd.ExcelFile(hosp_file)
-        sheet_names = xl.sheet_names
+        sheet_names = list(read_sheet_heads(hosp_file))
         print('File: ', hosp_file)
         print('Sheet names in spreadsheet: ', sheet_names)
         print('Sheet names allowed in allowlist: ', allowlist)
@@ -73,10 +79,7 @@ def test_spreadsheet_column_names_against_schema():
     for subdir in subdirs:
         subdir_path = os.path.join(dirpath, subdir)
         hosp_file = os.path.join(subdir_path, 'hospitalizations.xlsx')
-        xl = pd.ExcelFile(hosp_file)
-        sheet_names = xl.sheet_names
-        for s in sheet_names:
-            df = xl.parse(s, nrows=2)
+        for s, df in read_sheet_heads(hosp_file).items():
             print(df)
             columns_in_spreadsheet = list(df.columns)
             assert 'date' in columns_in_spreadsheet, \
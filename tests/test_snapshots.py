@@ -0,0 +1,184 @@
+# Copyright 2020 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+PIPELINE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/pipeline')
+SCRIPTS_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')), 'src/scripts')
+
+sys.path.append(PIPELINE_DIR)
+
+import cache_utils
+import config
+import load_utils
+import path_utils
+
+
+def test_blob_pointers_resolve():
+    for path, _, files in os.walk(path_utils.path_to('inputs_dir')):
+        for f in files:
+            if f.endswith(path_utils.BLOB_POINTER_SUFFIX):
+                pointer_path = os.path.join(path, f)
+                print(pointer_path)
+                assert path_utils.resolve_snapshot_file(pointer_path[:-len(path_utils.BLOB_POINTER_SUFFIX)])
+
+def test_blobs_match_their_names():
+    blob_store_dir = path_utils.path_to('blob_store_dir')
+    if not os.path.isdir(blob_store_dir):
+        pytest.skip('no blob store in data/inputs')
+    for path, _, files in os.walk(blob_store_dir):
+        for f in files:
+            sha = hashlib.sha256()
+            with open(os.path.join(path, f), 'rb') as blob:
+                sha.update(blob.read())
+            print(f)
+            assert f.split('.')[0] == sha.hexdigest()
+            assert os.path.basename(path) == f[:2]
+
+def test_compressed_snapshots_decompress():
+    for path, _, files in os.walk(path_utils.path_to('inputs_dir')):
+        for f in files:
+            if f.endswith('.gz'):
+                print(os.path.join(path, f))
+                with gzip.open(os.path.join(path, f), 'rb') as snapshot:
+                    while snapshot.read(1 << 20):
+                        pass
+
+def test_catalog_matches_snapshot_files():
+    inputs_dir = path_utils.path_to('inputs_dir')
+    catalog = path_utils.SnapshotCatalog(inputs_dir)
+    for fetch_string in os.listdir(inputs_dir):
+        for snapshot_dir in glob.glob(os.path.join(inputs_dir, fetch_string, '*', '*')):
+            if not os.path.isdir(snapshot_dir):
+                continue
+            for name in os.listdir(snapshot_dir):
+                if name.endswith(path_utils.BLOB_POINTER_SUFFIX):
+                    name = name[:-len(path_utils.BLOB_POINTER_SUFFIX)]
+                assert catalog.resolve(snapshot_dir, name) == path_utils.resolve_snapshot_file(
+                    os.path.join(snapshot_dir, name))
+
+def test_catalog_refreshes_changed_directories(tmp_path, monkeypatch):
+    source_dir = tmp_path / 'downloaded' / 'source'
+    (source_dir / '2020-12-14').mkdir(parents=True)
+    (source_dir / '2020-12-14' / 'data.csv').write_text('date,value\n')
+    (source_dir / 'not_a_date').mkdir()
+    # Back-date the directories, so that changes below always move their mtimes.
+    for path in [tmp_path, tmp_path / 'downloaded', source_dir, source_dir / '2020-12-14']:
+        os.utime(path, ns=(10**18, 10**18))
+    catalog = path_utils.SnapshotCatalog(str(tmp_path))
+    assert catalog.source_names('downloaded') == ['source']
+    assert [d['date'].isoformat() for d in catalog.snapshots(str(source_dir), 'data.csv')] == ['2020-12-14']
+
+    scanned = []
+    scan = path_utils.SnapshotCatalog._scan  # pylint: disable=protected-access
+    monkeypatch.setattr(path_utils.SnapshotCatalog, '_scan',
+                        staticmethod(lambda dir_path, mtime: scanned.append(dir_path) or scan(dir_path, mtime)))
+    catalog.snapshots(str(source_dir), 'data.csv')
+    assert not scanned
+
+    (source_dir / '2020-12-15').mkdir()
+    (source_dir / '2020-12-15' / 'data.csv.gz').write_bytes(gzip.compress(b'date,value\n'))
+    os.remove(source_dir / '2020-12-14' / 'data.csv')
+    snapshots = catalog.snapshots(str(source_dir), 'data.csv')
+    assert [d['path'] for d in snapshots] == [str(source_dir / '2020-12-15' / 'data.csv.gz')]
+    assert snapshots[0]['size'] == os.path.getsize(snapshots[0]['path'])
+    assert sorted(scanned) == [str(source_dir), str(source_dir / '2020-12-14'), str(source_dir / '2020-12-15')]
+
+def test_excel_sidecars_match_workbooks(tmp_path, monkeypatch):
+    monkeypatch.setitem(path_utils._resources, 'excel_cache_dir', str(tmp_path))  # pylint: disable=protected-access
+    sources = config.read_config(cc_by=True, cc_by_sa=True, google_tos=True, cc_by_nc=True,
+                                 filter_no_load_func=False, filter_no_data=False, filter_not_approved=False)
+    for params in sources.values():
+        if 'fetch' not in params or not params['fetch']['file'].endswith('.xlsx'):
+            continue
+        read_args = {'sheet_name': 0, 'skiprows': None, 'skipfooter': 0}
+        read_args.update({k: v for k, v in (params['load'].get('read') or {}).items() if k in read_args})
+        # Like the loader, use the newest snapshot that is a readable workbook.
+        for data_dict in path_utils.all_data_most_to_least_recent(params):
+            data_path = data_dict['path']
+            try:
+                workbook_df = pd.read_excel(data_path, **read_args)
+            except ValueError:
+                continue
+            print(data_path, read_args)
+            for _ in range(2):
+                pd.testing.assert_frame_equal(cache_utils.read_excel_cached(data_path, **read_args), workbook_df,
+                                              check_exact=True)
+            assert glob.glob(cache_utils.excel_sidecar_path(data_path, read_args) + '.*')
+            break
+
+
+SNAPSHOT_SOURCE = 'czech_republic_hospitalizations'
+SNAPSHOT_DATES = ['2020-12-22', '2020-12-23']
+
+# Copies the newest snapshot of SNAPSHOT_SOURCE into a fresh tree under
+# tmp_path on each of SNAPSHOT_DATES, and points path_utils at that tree.
+# Returns the source's params and the frame its original snapshot reads to.
+@pytest.fixture(name='snapshot_tree')
+def snapshot_tree_fixture(tmp_path, monkeypatch):
+    params = config.read_config(cc_by=True, cc_by_sa=True, cc_by_nc=True, google_tos=True)[SNAPSHOT_SOURCE]
+    original_path = path_utils.all_data_most_to_least_recent(params)[0]['path']
+    expected_df = load_utils.default_read_function(original_path, params)
+    monkeypatch.setattr(path_utils, 'root_dir', str(tmp_path))
+    os.makedirs(path_utils.path_to('spreadsheets_dir'))
+    for date in SNAPSHOT_DATES:
+        path_to_data = path_utils.path_to_data_for_date(params, date)
+        os.makedirs(path_to_data['dir'])
+        shutil.copyfile(original_path, os.path.join(path_to_data['dir'], path_to_data['file']))
+    return params, expected_df
+
+def run_script(script, *args):
+    subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, script), '--publish_dir', path_utils.root_dir]
+                   + list(args), check=True)
+
+def snapshot_dir_listings(params):
+    return [sorted(os.listdir(path_utils.path_to_data_for_date(params, date)['dir'])) for date in SNAPSHOT_DATES]
+
+def assert_snapshots_read_back(params, expected_df):
+    snapshots = path_utils.all_data_most_to_least_recent(params)
+    assert [d['date'].isoformat() for d in snapshots] == SNAPSHOT_DATES[::-1]
+    for data_dict in snapshots:
+        pd.testing.assert_frame_equal(load_utils.default_read_function(data_dict['path'], params), expected_df)
+
+def test_dedup_stores_identical_snapshots_once(snapshot_tree):
+    params, expected_df = snapshot_tree
+    file_name = params['fetch']['file']
+    run_script('dedup_snapshots.py')
+    assert snapshot_dir_listings(params) == [[file_name + path_utils.BLOB_POINTER_SUFFIX]] * 2
+    blobs = glob.glob(os.path.join(path_utils.path_to('blob_store_dir'), '*', '*'))
+    assert len(blobs) == 1
+    with open(blobs[0], 'rb') as blob:
+        assert os.path.basename(blobs[0]) == hashlib.sha256(blob.read()).hexdigest() + '.csv'
+    assert_snapshots_read_back(params, expected_df)
+
+def test_compressed_snapshots_read_back(snapshot_tree):
+    params, expected_df = snapshot_tree
+    file_name = params['fetch']['file']
+    run_script('compress_snapshots.py', '--compression', 'gz')
+    assert snapshot_dir_listings(params) == [[file_name + '.gz']] * 2
+    assert_snapshots_read_back(params, expected_df)
+    # Compression is deterministic, so compressed snapshots still deduplicate.
+    run_script('dedup_snapshots.py')
+    assert snapshot_dir_listings(params) == [[file_name + '.gz' + path_utils.BLOB_POINTER_SUFFIX]] * 2
+    assert len(glob.glob(os.path.join(path_utils.path_to('blob_store_dir'), '*', '*.gz'))) == 1
+    assert_snapshots_read_back(params, expected_df)